@@ -0,0 +1,194 @@
+"""
+Assembler benchmark suite.
+
+Times every phase of assemble_file (parse, label pass, variable pass, emit)
+on synthetic programs of configurable size and instruction mix, and on the
+example programs of "00 - Fitting Assembly & Hack Code Examples". Each run
+appends one JSON line with all its results to the output file, so results can
+be tracked over time.
+
+Usage: python3 Benchmark.py [--size N] [--repeat R] [--mix NAME ...]
+                            [--no-examples] [--output FILE]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import typing
+from Code import Code, COMP_DICT, DEST_DICT, JUMP_DICT
+from Main import add_labels, add_variables, write_command
+from Parser import Parser
+from SymbolTable import SymbolTable
+
+EXAMPLES_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "00 - Fitting Assembly & Hack Code Examples")
+
+# Relative weights of the kinds of generated lines, for each mix.
+MIXES = {
+    "label_heavy": {"label": 6, "c_command": 3, "constant": 1},
+    "variable_heavy": {"variable": 6, "c_command": 3, "constant": 1},
+    "c_command_heavy": {"c_command": 8, "constant": 1, "variable": 1},
+    "shift_heavy": {"shift": 6, "c_command": 3, "constant": 1},
+}
+
+SHIFT_COMPS = [comp for comp in COMP_DICT if comp[1:2] in ("<", ">")]
+REGULAR_COMPS = [comp for comp in COMP_DICT if comp not in SHIFT_COMPS]
+DESTS = [dest for dest in DEST_DICT if dest != "null"]
+JUMPS = [jump for jump in JUMP_DICT if jump != "null"]
+
+
+def generate_program(size: int, mix: dict[str, int], seed: int = 0) -> str:
+    """Generates a random, valid assembly program.
+
+    Args:
+        size (int): the number of generated lines (roughly, instructions).
+        mix (dict[str, int]): relative weights of the kinds of lines:
+            "label", "variable", "c_command", "shift" and "constant".
+        seed (int): the seed of the generator.
+
+    Returns:
+        str: the program.
+    """
+    generator = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    label_count = max(1, size * mix.get("label", 0) // sum(weights) // 2)
+    variable_count = min(2000, max(1, size // 20))
+    defined_labels = set()
+    lines = []
+    for kind in generator.choices(kinds, weights, k=size):
+        if kind == "label":
+            label = generator.randrange(label_count)
+            if label in defined_labels or generator.random() < 0.5:
+                lines.append(f"@LOOP_{label}\nD;JNE")  # backward or forward
+            else:
+                lines.append(f"(LOOP_{label})")
+                defined_labels.add(label)
+        elif kind == "variable":
+            lines.append(f"@var_{generator.randrange(variable_count)}\nM=D")
+        elif kind == "constant":
+            lines.append(f"@{generator.randrange(32768)}")
+        elif kind == "shift":
+            lines.append(f"{generator.choice(DESTS)}="
+                         f"{generator.choice(SHIFT_COMPS)}")
+        elif generator.random() < 0.8:
+            lines.append(f"{generator.choice(DESTS)}="
+                         f"{generator.choice(REGULAR_COMPS)}")
+        else:
+            lines.append(f"{generator.choice(REGULAR_COMPS)};"
+                         f"{generator.choice(JUMPS)}")
+    lines.extend(f"(LOOP_{label})" for label in range(label_count)
+                 if label not in defined_labels)
+    return "\n".join(lines) + "\n"
+
+
+def time_phases(source: str) -> dict[str, float]:
+    """Assembles source once, timing each phase of assemble_file.
+
+    Args:
+        source (str): the assembly program.
+
+    Returns:
+        dict[str, float]: the duration of each phase, in seconds.
+    """
+    timings = {}
+    start = time.perf_counter()
+    parser = Parser(io.StringIO(source))
+    timings["parse"] = time.perf_counter() - start
+
+    symbol_table = SymbolTable()
+    converter = Code()
+    start = time.perf_counter()
+    add_labels(parser, symbol_table)
+    timings["labels"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    add_variables(parser, symbol_table)
+    timings["variables"] = time.perf_counter() - start
+
+    output_file = io.StringIO()
+    start = time.perf_counter()
+    while parser.has_more_commands():
+        write_command(converter, output_file, parser, symbol_table)
+    timings["emit"] = time.perf_counter() - start
+
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+def benchmark(name: str, source: str, repeat: int) -> dict[str, typing.Any]:
+    """Times source repeat times and keeps the best time of each phase.
+
+    Args:
+        name (str): the name of the program.
+        source (str): the assembly program.
+        repeat (int): how many times to assemble the program.
+
+    Returns:
+        dict[str, typing.Any]: the results of the program.
+    """
+    runs = [time_phases(source) for _ in range(repeat)]
+    best = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+    instructions = sum(
+        1 for command in Parser(io.StringIO(source)).commands[:-1]
+        if command[0] != "(")
+    return {"program": name, "lines": source.count("\n"),
+            "instructions": instructions, **best,
+            "instructions_per_second": instructions / best["total"]}
+
+
+def example_programs() -> list[tuple[str, str]]:
+    """
+    Returns:
+        list[tuple[str, str]]: the name and source of each example program.
+    """
+    programs = []
+    for path in sorted(glob.glob(
+            os.path.join(glob.escape(EXAMPLES_DIRECTORY), "*", "*.asm"))):
+        with open(path, 'r') as input_file:
+            programs.append((os.path.basename(path), input_file.read()))
+    return programs
+
+
+if "__main__" == __name__:
+    argument_parser = argparse.ArgumentParser(prog="Benchmark")
+    argument_parser.add_argument(
+        "--size", type=int, default=100000,
+        help="lines in each synthetic program")
+    argument_parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="runs per program, the best time of each phase is kept")
+    argument_parser.add_argument(
+        "--mix", nargs="+", choices=sorted(MIXES), default=sorted(MIXES),
+        help="synthetic program mixes to run")
+    argument_parser.add_argument(
+        "--no-examples", action="store_true",
+        help="skip the example programs")
+    argument_parser.add_argument(
+        "--output", default="benchmark_results.jsonl",
+        help="appends the results of this run to this file")
+    arguments = argument_parser.parse_args()
+
+    programs = [] if arguments.no_examples else example_programs()
+    programs += [(f"{mix}_{arguments.size}",
+                  generate_program(arguments.size, MIXES[mix]))
+                 for mix in arguments.mix]
+    results = []
+    for name, source in programs:
+        results.append(benchmark(name, source, arguments.repeat))
+        result = results[-1]
+        print(f"{name:<28} {result['instructions']:>8} instructions  "
+              f"parse {result['parse']:.4f}s  labels {result['labels']:.4f}s  "
+              f"variables {result['variables']:.4f}s  "
+              f"emit {result['emit']:.4f}s  "
+              f"({result['instructions_per_second']:.0f} instructions/s)")
+    with open(arguments.output, 'a') as output_file:
+        output_file.write(json.dumps({
+            "timestamp": time.time(), "python": sys.version.split()[0],
+            "platform": platform.platform(), "size": arguments.size,
+            "repeat": arguments.repeat, "results": results}) + "\n")
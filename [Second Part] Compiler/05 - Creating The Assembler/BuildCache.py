@@ -0,0 +1,179 @@
+"""
+An on-disk cache of assembled programs, used to skip reassembling .asm files
+that did not change since they were last assembled.
+
+Entries are keyed by a hash of the .asm contents, of the assembler's
+instruction tables (COMP_DICT, DEST_DICT, JUMP_DICT) and of the output format,
+so editing the tables invalidates every entry. The cache is bounded in size:
+when it grows over its limit, the least recently used entries are evicted.
+
+Usage: python3 BuildCache.py stats|clear [cache directory]
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import typing
+from Code import COMP_DICT, DEST_DICT, JUMP_DICT
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.path.expanduser("~"), ".cache", "hack-assembler")
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # in bytes
+
+CACHE_VERSION = b"1"  # bump when the assembler output changes
+TABLES_HASH = hashlib.sha256(
+    json.dumps([COMP_DICT, DEST_DICT, JUMP_DICT]).encode()).digest()
+
+
+class BuildCache:
+    """A size-bounded, least-recently-used cache of assembler outputs."""
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY,
+                 max_size: int = DEFAULT_MAX_SIZE) -> None:
+        """Opens the cache, creating its directory if needed.
+
+        Args:
+            directory (str): the directory that holds the cache.
+            max_size (int): the maximal total size of the entries, in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.objects = os.path.join(directory, "objects")
+        self.stats_path = os.path.join(directory, "stats.json")
+        os.makedirs(self.objects, exist_ok=True)
+
+    @staticmethod
+    def key(source: bytes, extension: str) -> str:
+        """
+        Args:
+            source (bytes): the contents of the .asm file.
+            extension (str): the extension of the output: ".hack", ".rom",
+                or ".hobj" for relocatable objects.
+
+        Returns:
+            str: the key of the output of source in the given format.
+        """
+        digest = hashlib.sha256(CACHE_VERSION + TABLES_HASH)
+        digest.update(extension.encode() + b"\0")
+        digest.update(source)
+        return digest.hexdigest() + extension
+
+    def restore(self, key: str, output_path: str) -> typing.Optional[bytes]:
+        """Writes the cached output of key to output_path.
+
+        Args:
+            key (str): a key returned by BuildCache.key.
+            output_path (str): where to restore the output.
+
+        Returns:
+            bytes: the restored output, or None if key is not in the cache.
+        """
+        entry_path = os.path.join(self.objects, key)
+        try:
+            with open(entry_path, 'rb') as entry:
+                data = entry.read()
+            os.utime(entry_path)  # mark the entry as recently used
+        except FileNotFoundError:
+            return None
+        with open(output_path, 'wb') as output_file:
+            output_file.write(data)
+        return data
+
+    def store(self, key: str, output_path: str) -> None:
+        """Adds the output at output_path to the cache under key.
+
+        Args:
+            key (str): a key returned by BuildCache.key.
+            output_path (str): the output to cache.
+        """
+        with open(output_path, 'rb') as output_file:
+            data = output_file.read()
+        # write then rename, so concurrent readers never see a partial entry
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.objects)
+        with os.fdopen(descriptor, 'wb') as entry:
+            entry.write(data)
+        os.replace(temporary_path, os.path.join(self.objects, key))
+
+    def entries(self) -> list[os.DirEntry]:
+        """
+        Returns:
+            list[os.DirEntry]: the entries, least recently used first.
+        """
+        entries = [entry for entry in os.scandir(self.objects)
+                   if entry.is_file()]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return entries
+
+    def evict(self) -> int:
+        """Removes least recently used entries until the cache fits in
+        max_size.
+
+        Returns:
+            int: the number of evicted entries.
+        """
+        entries = self.entries()
+        total_size = sum(entry.stat().st_size for entry in entries)
+        evicted = 0
+        for entry in entries:
+            if total_size <= self.max_size:
+                break
+            total_size -= entry.stat().st_size
+            os.remove(entry.path)
+            evicted += 1
+        return evicted
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns:
+            dict[str, int]: the "hits", "misses" and "bytes_saved" recorded
+            so far.
+        """
+        try:
+            with open(self.stats_path, 'r') as stats_file:
+                return json.load(stats_file)
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+    def record(self, hits: int, misses: int, bytes_saved: int) -> None:
+        """Adds the results of a build to the recorded stats.
+
+        Args:
+            hits (int): number of outputs restored from the cache.
+            misses (int): number of outputs that had to be assembled.
+            bytes_saved (int): total size of the restored outputs.
+        """
+        stats = self.stats()
+        stats["hits"] += hits
+        stats["misses"] += misses
+        stats["bytes_saved"] += bytes_saved
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'w') as stats_file:
+            json.dump(stats, stats_file)
+        os.replace(temporary_path, self.stats_path)
+
+    def clear(self) -> None:
+        """Removes all the entries and the recorded stats."""
+        for entry in self.entries():
+            os.remove(entry.path)
+        if os.path.exists(self.stats_path):
+            os.remove(self.stats_path)
+
+
+if "__main__" == __name__:
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ("stats", "clear"):
+        sys.exit("Invalid usage, please use: "
+                 "BuildCache stats|clear [cache directory]")
+    cache = BuildCache(*sys.argv[2:])
+    if sys.argv[1] == "clear":
+        cache.clear()
+        sys.exit()
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    entries = cache.entries()
+    print(f"Hits: {stats['hits']}")
+    print(f"Misses: {stats['misses']}")
+    print(f"Hit rate: {stats['hits'] / lookups if lookups else 0:.1%}")
+    print(f"Bytes saved: {stats['bytes_saved']}")
+    print(f"Entries: {len(entries)} "
+          f"({sum(entry.stat().st_size for entry in entries)} bytes)")
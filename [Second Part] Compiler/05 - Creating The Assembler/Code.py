@@ -63,7 +63,8 @@ COMP_DICT = {
     "A<<": "0100000",
     "D<<": "0110000",
     "M<<": "1100000",
-    "A>>": "0010000",
+    "A>>": "0000000",
+    "D>>": "0010000",
     "M>>": "1000000"
 }
 
@@ -79,9 +80,35 @@ JUMP_DICT = {
 }
 
 
+def c_command_word(comp: str, dest: str, jump: str) -> int:
+    """
+    Args:
+        comp (str): a comp mnemonic string.
+        dest (str): a dest mnemonic string.
+        jump (str): a jump mnemonic string.
+
+    Returns:
+        int: the 16-bit value of the C-command made of the given mnemonics.
+    """
+    prefix = "101" if len(comp) >= 2 and comp[1] in "<>" else "111"
+    return int(prefix + COMP_DICT[comp] + DEST_DICT[dest] + JUMP_DICT[jump], 2)
+
+
+# Every legal spelling of "dest=comp;jump" (without the "null" parts) mapped
+# straight to its 16-bit value.
+C_COMMAND_TABLE = {
+    (dest + "=" if dest != "null" else "") + comp +
+    (";" + jump if jump != "null" else ""): c_command_word(comp, dest, jump)
+    for comp in COMP_DICT for dest in DEST_DICT for jump in JUMP_DICT
+}
+
+
 class Code:
     """Translates Hack assembly language mnemonics into binary codes."""
 
+    # C-commands spelled differently than in C_COMMAND_TABLE (e.g. "null=D").
+    memo = {}
+
     @staticmethod
     def dest(mnemonic: str) -> str:
         """
@@ -139,3 +166,21 @@ class Code:
             list[str]: converted [comp, dest, jump] to binary.
         """
         return self.comp(comp) + self.dest(dest) + self.jump(jump)
+
+    def encode(self, command: str) -> int:
+        """
+        Args:
+            command (str): a C-command without spaces, e.g. "AM=M+1;JGT".
+
+        Returns:
+            int: the 16-bit value of the given C-command.
+        """
+        word = C_COMMAND_TABLE.get(command)
+        if word is None:
+            word = self.memo.get(command)
+            if word is None:
+                dest, _, comp_jump = command.rpartition("=")
+                comp, _, jump = comp_jump.partition(";")
+                word = c_command_word(comp, dest or "null", jump or "null")
+                self.memo[command] = word
+        return word
@@ -0,0 +1,214 @@
+"""
+Relocatable object files and a linker for separately assembled modules.
+
+An object file holds the assembled words of a single .asm module. Predefined
+symbols and numbers are resolved when the module is assembled, while every
+other symbol (labels, including the module's own, and variables) is kept as
+a reference to be resolved by the linker:
+
+    # Hack object v1
+    labels <count>        followed by "<name> <offset in the module>" lines
+    references <count>    followed by "<offset in the module> <symbol>" lines
+    code <count>          followed by one decimal word per line
+
+The linker places the modules one after the other in the given order,
+resolves the references to the labels of all the modules, and assigns the
+remaining symbols to variables from address 16 upwards in order of first
+appearance, exactly as if the concatenated modules were assembled as one file.
+
+Usage: python3 Linker.py <output.hack | output.rom> <module.hobj | module.asm>...
+"""
+import os
+import sys
+import typing
+from array import array
+from Code import Code
+from Parser import Parser
+from SymbolTable import SymbolTable
+import RomImage
+
+HEADER = "# Hack object v1\n"
+EXTENSION = ".hobj"
+
+
+class ObjectFile:
+    """A relocatable, separately assembled module."""
+
+    def __init__(self, words: array, labels: dict[str, int],
+                 references: list[tuple[int, str]]) -> None:
+        """
+        Args:
+            words (array): the assembled words, as an array('H'), with 0 in
+                place of every unresolved reference.
+            labels (dict[str, int]): the labels of the module and their
+                offsets in it.
+            references (list[tuple[int, str]]): (offset, symbol) of every
+                unresolved reference, by order of offset.
+        """
+        self.words = words
+        self.labels = labels
+        self.references = references
+
+
+def assemble_object(input_file: typing.TextIO) -> ObjectFile:
+    """Assembles a single module into an object.
+
+    Args:
+        input_file (typing.TextIO): the module to assemble.
+
+    Returns:
+        ObjectFile: the assembled module.
+    """
+    parser = Parser(input_file)
+    symbol_table = SymbolTable()
+    converter = Code()
+    labels = {}
+    label_counter = 0
+    for i in range(len(parser.commands) - 1):
+        if parser.commands[i][0] == "(":
+            labels[parser.commands[i][1:-1]] = i - label_counter
+            label_counter += 1
+
+    words = array('H')
+    references = []
+    for command in parser.commands[:-1]:
+        if command[0] == "(":
+            continue
+        if command[0] != "@":
+            words.append(converter.encode(command))
+        elif command[1:].isdigit():
+            words.append(int(command[1:]))
+        elif command[1:] not in labels and symbol_table.contains(command[1:]):
+            words.append(symbol_table.get_address(command[1:]))
+        else:
+            references.append((len(words), command[1:]))
+            words.append(0)
+    return ObjectFile(words, labels, references)
+
+
+def write_object(output_file: typing.TextIO, object_file: ObjectFile) -> None:
+    """Writes an object file.
+
+    Args:
+        output_file (typing.TextIO): writes the object to this file.
+        object_file (ObjectFile): the object to write.
+    """
+    output_file.write(HEADER)
+    output_file.write(f"labels {len(object_file.labels)}\n")
+    output_file.writelines(f"{name} {offset}\n"
+                           for name, offset in object_file.labels.items())
+    output_file.write(f"references {len(object_file.references)}\n")
+    output_file.writelines(f"{offset} {symbol}\n"
+                           for offset, symbol in object_file.references)
+    output_file.write(f"code {len(object_file.words)}\n")
+    output_file.writelines(f"{word}\n" for word in object_file.words)
+
+
+def read_object(input_file: typing.TextIO) -> ObjectFile:
+    """Reads an object file.
+
+    Args:
+        input_file (typing.TextIO): the object file.
+
+    Returns:
+        ObjectFile: the object.
+    """
+    if input_file.readline() != HEADER:
+        raise ValueError(f"{source_name(input_file)} is not a Hack object")
+
+    def section(name: str) -> list[str]:
+        title, count = input_file.readline().split()
+        if title != name:
+            raise ValueError(f"expected the {name} section, found {title}")
+        return [input_file.readline().rstrip("\n") for _ in range(int(count))]
+
+    labels = {}
+    for line in section("labels"):
+        name, offset = line.rsplit(" ", 1)
+        labels[name] = int(offset)
+    references = []
+    for line in section("references"):
+        offset, symbol = line.split(" ", 1)
+        references.append((int(offset), symbol))
+    words = array('H', map(int, section("code")))
+    return ObjectFile(words, labels, references)
+
+
+def assemble_object_file(input_file: typing.TextIO,
+                         output_file: typing.TextIO) -> int:
+    """Assembles a single module into an object file.
+
+    Args:
+        input_file (typing.TextIO): the module to assemble.
+        output_file (typing.TextIO): writes the object to this file.
+
+    Returns:
+        int: the number of instructions written.
+    """
+    object_file = assemble_object(input_file)
+    write_object(output_file, object_file)
+    return len(object_file.words)
+
+
+def link(object_files: list[ObjectFile]) -> tuple[array, dict[str, int]]:
+    """Links objects into a single program.
+
+    Args:
+        object_files (list[ObjectFile]): the objects, in the order they
+            should be placed in the ROM.
+
+    Returns:
+        tuple[array, dict[str, int]]: the program as an array('H') of 16-bit
+        words, and the labels and variables it defines.
+    """
+    symbols = {}
+    base = 0
+    for object_file in object_files:
+        for name, offset in object_file.labels.items():
+            if name in symbols:
+                raise ValueError(f"label {name} is defined in two modules")
+            symbols[name] = base + offset
+        base += len(object_file.words)
+
+    words = array('H')
+    address_counter = 16  # counter for assigning new variables
+    for object_file in object_files:
+        module = array('H', object_file.words)
+        for offset, symbol in object_file.references:
+            if symbol not in symbols:
+                symbols[symbol] = address_counter
+                address_counter += 1
+            module[offset] = symbols[symbol]
+        words.extend(module)
+    return words, symbols
+
+
+def load_module(path: str) -> ObjectFile:
+    """Reads an object file, or assembles an .asm file into an object."""
+    with open(path, 'r') as input_file:
+        if os.path.splitext(path)[1].lower() == ".asm":
+            return assemble_object(input_file)
+        return read_object(input_file)
+
+
+def source_name(input_file: typing.TextIO) -> str:
+    """Returns the name of the file an input was read from."""
+    return os.path.basename(getattr(input_file, "name", "<input>"))
+
+
+if "__main__" == __name__:
+    if len(sys.argv) < 3:
+        sys.exit("Invalid usage, please use: "
+                 "Linker <output.hack | output.rom> <module.hobj | module.asm>...")
+    output_path = sys.argv[1]
+    try:
+        words, symbols = link([load_module(path) for path in sys.argv[2:]])
+    except ValueError as error:
+        sys.exit(f"Link failed: {error}")
+    if os.path.splitext(output_path)[1].lower() == RomImage.EXTENSION:
+        with open(output_path, 'wb') as output_file:
+            RomImage.write_image(output_file, words, symbols)
+    else:
+        with open(output_path, 'w') as output_file:
+            output_file.writelines(format(word, "016b") + "\n"
+                                   for word in words)
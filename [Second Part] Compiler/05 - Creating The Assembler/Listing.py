@@ -0,0 +1,165 @@
+"""
+Assembler listings: an index from ROM addresses to the source lines they were
+assembled from.
+
+A listing is a text file with a few "#" header lines naming the source files,
+followed by one tab-separated row per instruction, sorted by address:
+
+    address, source file index, line number, symbol, labels, original text
+
+"symbol" is the symbol of an A-command and its resolved value, as
+"symbol=value" (empty for other commands), and "labels" are the labels that
+point to the address, separated by commas.
+Since both the addresses and the line numbers of a source file only grow from
+one row to the next, both directions of lookup are binary searches.
+
+Usage: python3 Listing.py <file.lst> <address>
+prints the source of the instruction at the given ROM address.
+"""
+import bisect
+import sys
+import typing
+from array import array
+from Parser import Parser
+from SymbolTable import SymbolTable
+
+HEADER = "# Hack listing v1\n"
+EXTENSION = ".lst"
+
+
+def write_listing(output_file: typing.TextIO, parser: Parser,
+                  symbol_table: SymbolTable, source_name: str) -> None:
+    """Writes the listing of a parsed program.
+
+    Args:
+        output_file (typing.TextIO): writes the listing to this file.
+        parser (Parser): the parser of the program, created with
+            keep_source=True.
+        symbol_table (SymbolTable): the symbols of the program.
+        source_name (str): the name of the source file.
+    """
+    output_file.write(HEADER)
+    output_file.write(f"# file 0 {source_name}\n")
+    address = 0
+    labels = []
+    for command, line_number in zip(parser.commands, parser.line_numbers):
+        if command[0] == "(":
+            labels.append(command[1:-1])
+            continue
+        symbol = ""
+        if command[0] == "@" and not command[1:].isdigit():
+            symbol = f"{command[1:]}={symbol_table.get_address(command[1:])}"
+        text = parser.source_lines[line_number - 1].strip()
+        output_file.write(f"{address}\t0\t{line_number}\t{symbol}\t"
+                          f"{','.join(labels)}\t{text}\n")
+        labels = []
+        address += 1
+
+
+class Listing:
+    """A loaded listing, with lookups from addresses to source lines and
+    back."""
+
+    def __init__(self, input_file: typing.TextIO) -> None:
+        """Loads a listing.
+
+        Args:
+            input_file (typing.TextIO): the listing file.
+        """
+        if input_file.readline() != HEADER:
+            raise ValueError("not a Hack listing")
+        self.files = []
+        self.addresses = array('L')
+        self.file_indices = array('H')
+        self.line_numbers = array('L')
+        self.symbols = []
+        self.labels = []
+        self.texts = []
+        self.functions = []  # the last label at or before each row
+        for line in input_file:
+            if line.startswith("# file "):
+                self.files.append(line.rstrip("\n").split(" ", 3)[3])
+                continue
+            address, file_index, line_number, symbol, labels, text = \
+                line.rstrip("\n").split("\t", 5)
+            self.addresses.append(int(address))
+            self.file_indices.append(int(file_index))
+            self.line_numbers.append(int(line_number))
+            self.symbols.append(symbol)
+            self.labels.append(labels.split(",") if labels else [])
+            self.texts.append(text)
+            self.functions.append(self.labels[-1][-1] if labels else
+                                  self.functions[-1] if self.functions else None)
+
+    def entry(self, index: int) -> dict[str, typing.Any]:
+        """
+        Args:
+            index (int): the index of a row.
+
+        Returns:
+            dict[str, typing.Any]: the row as a dictionary.
+        """
+        symbol, _, value = self.symbols[index].rpartition("=")
+        return {"address": self.addresses[index],
+                "file": self.files[self.file_indices[index]],
+                "line": self.line_numbers[index],
+                "symbol": symbol or None,
+                "value": int(value) if value else None,
+                "labels": self.labels[index],
+                "text": self.texts[index]}
+
+    def source_of(self, address: int) -> typing.Optional[dict]:
+        """
+        Args:
+            address (int): a ROM address.
+
+        Returns:
+            dict: the row of the instruction at address, or None if there is
+            no such instruction.
+        """
+        index = bisect.bisect_left(self.addresses, address)
+        if index < len(self.addresses) and self.addresses[index] == address:
+            return self.entry(index)
+        return None
+
+    def function_of(self, address: int) -> typing.Optional[str]:
+        """
+        Args:
+            address (int): a ROM address.
+
+        Returns:
+            str: the last label defined at or before address, which is the
+            enclosing function for code written by the VM translator.
+        """
+        index = bisect.bisect_right(self.addresses, address) - 1
+        return self.functions[index] if index >= 0 else None
+
+    def addresses_of(self, line_number: int,
+                     file: typing.Optional[str] = None) -> list[int]:
+        """
+        Args:
+            line_number (int): a line in a source file.
+            file (str): the source file, may be omitted if the listing has a
+                single source file.
+
+        Returns:
+            list[int]: the ROM addresses assembled from that line (empty if
+            the line is a comment, a label or blank).
+        """
+        file_index = self.files.index(file) if file is not None else 0
+        low = bisect.bisect_left(self.file_indices, file_index)
+        high = bisect.bisect_right(self.file_indices, file_index)
+        first = bisect.bisect_left(self.line_numbers, line_number, low, high)
+        last = bisect.bisect_right(self.line_numbers, line_number, first, high)
+        return [self.addresses[index] for index in range(first, last)]
+
+
+if "__main__" == __name__:
+    if not len(sys.argv) == 3:
+        sys.exit("Invalid usage, please use: Listing <file.lst> <address>")
+    with open(sys.argv[1], 'r') as listing_file:
+        listing = Listing(listing_file)
+    entry = listing.source_of(int(sys.argv[2]))
+    if entry is None:
+        sys.exit(f"No instruction at address {sys.argv[2]}")
+    print(f"{entry['file']}:{entry['line']}: {entry['text']}")
@@ -6,75 +6,457 @@ as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 from ast import parse
+import argparse
+import concurrent.futures
+import functools
+import io
 import os
+import shutil
 import sys
+import tempfile
+import time
 import typing
+from array import array
 from SymbolTable import SymbolTable
 from Parser import Parser
 from Code import Code
+from BuildCache import BuildCache, DEFAULT_DIRECTORY, DEFAULT_MAX_SIZE
+import Linker
+import Listing
+import RomImage
 
 
 def assemble_file(
-        input_file: typing.TextIO, output_file: typing.TextIO) -> None:
+        input_file: typing.TextIO, output_file: typing.TextIO,
+        listing_file: typing.Optional[typing.TextIO] = None) -> int:
     """Assembles a single file.
 
     Args:
         input_file (typing.TextIO): the file to assemble.
         output_file (typing.TextIO): writes all output to this file.
+        listing_file (typing.TextIO): if given, writes the listing of the
+            program (see Listing.py) to this file.
+
+    Returns:
+        int: the number of instructions written.
     """
-    parser = Parser(input_file)  # parse the input file
+    parser = Parser(input_file, keep_source=listing_file is not None)
     symbol_table = SymbolTable()
     converter = Code()  # code object - converts symbols to machine language
-    address_counter = 16  # counter for assigning new variables
-    label_counter = 0
+    add_labels(parser, symbol_table)
+    add_variables(parser, symbol_table)
+    if listing_file is not None:
+        Listing.write_listing(listing_file, parser, symbol_table,
+                              source_name(input_file))
+
+    while parser.has_more_commands():  # write all commands
+        write_command(converter, output_file, parser, symbol_table)
+    return sum(1 for command in parser.commands[:-1] if command[0] != "(")
+
+
+def assemble_image(
+        input_file: typing.TextIO, output_file: typing.BinaryIO,
+        listing_file: typing.Optional[typing.TextIO] = None) -> int:
+    """Assembles a single file into a packed binary ROM image.
+
+    Args:
+        input_file (typing.TextIO): the file to assemble.
+        output_file (typing.BinaryIO): writes the image to this file.
+        listing_file (typing.TextIO): if given, writes the listing of the
+            program (see Listing.py) to this file.
+
+    Returns:
+        int: the number of instructions written.
+    """
+    words, symbols = assemble_words(input_file, listing_file)
+    RomImage.write_image(output_file, words, symbols)
+    return len(words)
+
+
+def assemble_words(
+        input_file: typing.TextIO,
+        listing_file: typing.Optional[typing.TextIO] = None
+) -> tuple[array, dict[str, int]]:
+    """Assembles a single file in memory.
+
+    Args:
+        input_file (typing.TextIO): the file to assemble.
+        listing_file (typing.TextIO): if given, writes the listing of the
+            program (see Listing.py) to this file.
+
+    Returns:
+        tuple[array, dict[str, int]]: the program as an array('H') of 16-bit
+        words, and the labels and variables it defines.
+    """
+    parser = Parser(input_file, keep_source=listing_file is not None)
+    symbol_table = SymbolTable()
+    converter = Code()
+    symbols = add_labels(parser, symbol_table)
+    symbols.update(add_variables(parser, symbol_table))
+    if listing_file is not None:
+        Listing.write_listing(listing_file, parser, symbol_table,
+                              source_name(input_file))
+
+    words = array('H')
+    while parser.has_more_commands():
+        word = encode_command(converter, parser, symbol_table)
+        if word is not None:
+            words.append(word)
+        parser.advance()
+    return words, symbols
+
 
+def assemble(source: str) -> array:
+    """Assembles a program given as text. Every call is independent of the
+    previous ones, so a long-lived process can assemble any number of
+    programs.
+
+    Args:
+        source (str): the assembly program.
+
+    Returns:
+        array: the program as an array('H') of 16-bit words.
+    """
+    return assemble_words(io.StringIO(source))[0]
+
+
+def assemble_batch(sources: typing.Iterable[str]) -> list[array]:
+    """Assembles many programs given as text.
+
+    Args:
+        sources (typing.Iterable[str]): the assembly programs.
+
+    Returns:
+        list[array]: the programs as arrays of 16-bit words, in order.
+    """
+    return [assemble(source) for source in sources]
+
+
+def source_name(input_file: typing.TextIO) -> str:
+    """Returns the name of the file an input was read from."""
+    return os.path.basename(getattr(input_file, "name", "<input>"))
+
+
+def add_labels(parser: Parser, symbol_table: SymbolTable) -> dict[str, int]:
+    """Adds the L commands of the parsed file to the symbol table.
+
+    Returns:
+        dict[str, int]: the labels that were added and their ROM addresses.
+    """
+    labels = {}
+    label_counter = 0
     for i in range(len(parser.commands)):  # adding the L commands to the symbol table
         if parser.commands[i][0] == "(":
+            labels[parser.commands[i][1:-1]] = i - label_counter
             symbol_table.add_entry(parser.commands[i][1:-1], i - label_counter)
             label_counter += 1
+    return labels
+
 
+def add_variables(parser: Parser,
+                  symbol_table: SymbolTable) -> dict[str, int]:
+    """Adds the variables of the parsed file to the symbol table, from
+    address 16 upwards. Should be called after add_labels.
+
+    Returns:
+        dict[str, int]: the variables that were added and their RAM addresses.
+    """
+    variables = {}
+    address_counter = 16  # counter for assigning new variables
     for i in range(len(parser.commands)):  # adding varriables entries
         if parser.commands[i][0] == "@" and (not parser.commands[i][1].isdigit()) and not \
                 symbol_table.contains(parser.commands[i][1:]):
+            variables[parser.commands[i][1:]] = address_counter
             symbol_table.add_entry(parser.commands[i][1:], address_counter)
             address_counter += 1
+    return variables
 
-    while parser.has_more_commands():  # write all commands
-        write_command(converter, output_file, parser, symbol_table)
 
+def assemble_file_streaming(
+        input_file: typing.TextIO, output_file: typing.TextIO) -> int:
+    """Assembles a single file in one pass over the input.
+    Commands are read line by line and written as soon as they are parsed.
+    A-commands whose symbol is not yet known get a placeholder, and are
+    backpatched once the whole input was read: labels get their ROM address,
+    and all other symbols become variables from address 16 upwards, in order
+    of first appearance (exactly like assemble_file).
 
-def write_command(converter, output_file, parser, symbol_table):
-    """Writes the command to the output file."""
+    Args:
+        input_file (typing.TextIO): the file to assemble.
+        output_file (typing.TextIO): writes all output to this file. If it is
+            not seekable, the output is staged in a temporary file first.
+
+    Returns:
+        int: the number of instructions written.
+    """
+    if not output_file.seekable():
+        with tempfile.TemporaryFile('w+') as staging_file:
+            instructions = assemble_file_streaming(input_file, staging_file)
+            staging_file.seek(0)
+            shutil.copyfileobj(staging_file, output_file)
+        return instructions
+
+    parser = Parser(input_file, streaming=True)
+    symbol_table = SymbolTable()
+    converter = Code()
+    references = {}  # symbol -> ROM addresses of the A-commands using it
+    unresolved = set()  # symbols that were written with a wrong value
+    labels = set()
+    rom_address = 0
+    start = output_file.tell()
+
+    while parser.has_more_commands():
+        command_type = parser.command_type()
+        if command_type == "L_COMMAND":
+            label = parser.symbol()
+            if label in references:  # forward reference or redefinition
+                unresolved.add(label)
+            symbol_table.add_entry(label, rom_address)
+            labels.add(label)
+        elif command_type == "A_COMMAND" and not parser.symbol().isdigit() \
+                and (parser.symbol() in labels or
+                     not symbol_table.contains(parser.symbol())):
+            symbol = parser.symbol()
+            references.setdefault(symbol, array('L')).append(rom_address)
+            if symbol in labels:
+                value = symbol_table.get_address(symbol)
+            else:
+                value = 0  # placeholder, backpatched below
+                unresolved.add(symbol)
+            output_file.write(format(value, "016b") + "\n")
+            rom_address += 1
+        else:
+            write_command(converter, output_file, parser, symbol_table)
+            rom_address += 1
+            continue
+        parser.advance()
+
+    if not unresolved:
+        return rom_address
+    end = output_file.tell()
+    line_width = (end - start) // rom_address  # all lines have the same width
+    address_counter = 16  # counter for assigning new variables
+    for symbol, addresses in references.items():
+        if symbol not in labels:
+            symbol_table.add_entry(symbol, address_counter)
+            address_counter += 1
+        if symbol not in unresolved:
+            continue
+        line = format(int(symbol_table.get_address(symbol)), "016b")
+        for address in addresses:
+            output_file.seek(start + address * line_width)
+            output_file.write(line)
+    output_file.seek(end)
+    return rom_address
+
+
+def assemble_path(input_path: str, stream: bool = False, rom: bool = False,
+                  cache: typing.Optional[BuildCache] = None,
+                  listing: bool = False,
+                  obj: bool = False) -> tuple[int, int, bool]:
+    """Assembles the file at input_path into a .hack file (or a .rom image,
+    or a relocatable object) next to it.
+
+    Args:
+        input_path (str): path of the .asm file.
+        stream (bool): use assemble_file_streaming.
+        rom (bool): write a packed ROM image instead of a .hack file.
+        cache (BuildCache): if given, the output is restored from this cache
+            when the input did not change, and stored in it otherwise.
+        listing (bool): also write a .lst listing next to the output (the
+            file is then always assembled, never restored from the cache).
+        obj (bool): write a relocatable object file (see Linker.py) instead
+            of a .hack file.
+
+    Returns:
+        tuple[int, int, bool]: the number of instructions written, the
+        number of bytes restored from the cache (0 if the file was
+        assembled), and whether the output was restored from the cache.
+    """
+    filename, extension = os.path.splitext(input_path)
+    if rom:
+        output_path = filename + RomImage.EXTENSION
+        assemble, mode = assemble_image, 'wb'
+    elif obj:
+        output_path = filename + Linker.EXTENSION
+        assemble, mode = Linker.assemble_object_file, 'w'
+    else:
+        output_path = filename + ".hack"
+        assemble = assemble_file_streaming if stream else assemble_file
+        mode = 'w'
+    if cache is not None and not listing:
+        with open(input_path, 'rb') as input_file:
+            key = cache.key(input_file.read(), os.path.splitext(output_path)[1])
+        data = cache.restore(key, output_path)
+        if data is not None:
+            if rom:
+                return RomImage.HEADER.unpack_from(data)[1], len(data), True
+            if obj:
+                return int(data[data.rindex(b"\ncode ") + 6:].split()[0]), \
+                    len(data), True
+            return data.count(b"\n"), len(data), True
+    listing_path = filename + Listing.EXTENSION
+    try:
+        with open(input_path, 'r') as input_file, \
+                open(output_path, mode) as output_file:
+            if listing:
+                with open(listing_path, 'w') as listing_file:
+                    instructions = assemble(
+                        input_file, output_file, listing_file)
+            else:
+                instructions = assemble(input_file, output_file)
+    except Exception:
+        for path in (output_path, listing_path) if listing else (output_path,):
+            if os.path.exists(path):  # don't leave a partial output behind
+                os.remove(path)
+        raise
+    if cache is not None and not listing:
+        cache.store(key, output_path)
+    return instructions, 0, False
+
+
+def try_assemble_path(
+        input_path: str, stream: bool = False, rom: bool = False,
+        cache: typing.Optional[BuildCache] = None,
+        listing: bool = False,
+        obj: bool = False) -> tuple[int, int, bool, str]:
+    """Like assemble_path, but reports a failure instead of raising it.
+
+    Returns:
+        tuple[int, int, bool, str]: the result of assemble_path, and the error
+        message if the file could not be assembled (None otherwise).
+    """
+    try:
+        return *assemble_path(
+            input_path, stream, rom, cache, listing, obj), None
+    except Exception as error:
+        return 0, 0, False, f"{type(error).__name__}: {error}"
+
+
+def assemble_files(input_paths: list[str], jobs: int = 1,
+                   stream: bool = False, rom: bool = False,
+                   cache: typing.Optional[BuildCache] = None,
+                   listing: bool = False, obj: bool = False) -> list[tuple]:
+    """Assembles many files, fanning them out to a pool of jobs processes.
+    Each worker writes straight to the output file of the input it got, so
+    only the results below are sent back. A failing file does not stop the
+    others.
+
+    Args:
+        input_paths (list[str]): paths of the .asm files.
+        jobs (int): number of worker processes, 1 assembles in-process.
+        stream (bool): use assemble_file_streaming.
+        rom (bool): write packed ROM images instead of .hack files.
+        cache (BuildCache): an optional cache of previous outputs.
+        listing (bool): also write a .lst listing next to each output.
+        obj (bool): write relocatable object files instead of .hack files.
+
+    Returns:
+        list[tuple]: (input path, instructions, bytes restored from the cache,
+        whether it was restored, error or None) for each input, in the order
+        of input_paths.
+    """
+    worker = functools.partial(
+        try_assemble_path, stream=stream, rom=rom, cache=cache,
+        listing=listing, obj=obj)
+    if jobs == 1 or len(input_paths) < 2:
+        results = map(worker, input_paths)
+        return [(path, *result) for path, result in zip(input_paths, results)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(worker, input_paths)
+        return [(path, *result) for path, result in zip(input_paths, results)]
+
+
+def encode_command(converter, parser, symbol_table) -> typing.Optional[int]:
+    """Returns the 16-bit value of the current command, or None if the
+    current command is an L command."""
 
     if parser.command_type() == "A_COMMAND":
         value = symbol_table.get_address(parser.symbol()) if not parser.symbol().isdigit() else parser.symbol()
-        output_file.write(format(int(value), "016b") + "\n")
+        return int(value)
 
     elif parser.command_type() == "C_COMMAND":
-        is_extended = converter.is_extended_c_command(parser.comp())
-        # check if the command is extended and get the right control bit
-        comp_dest_jump = converter.convert_to_binary(*parser.parse_command())
-        # convert the command to binary
-        output_file.write("1" + is_extended + "1" + comp_dest_jump + "\n")
+        return converter.encode(parser.current_command)
+
+
+def write_command(converter, output_file, parser, symbol_table):
+    """Writes the command to the output file."""
+
+    word = encode_command(converter, parser, symbol_table)
+    if word is not None:
+        output_file.write(format(word, "016b") + "\n")
 
     parser.advance()
 
 
 if "__main__" == __name__:
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: Assembler <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    argument_parser = argparse.ArgumentParser(prog="Assembler")
+    argument_parser.add_argument("path", help="an .asm file or a directory")
+    output_mode = argument_parser.add_mutually_exclusive_group()
+    output_mode.add_argument(
+        "--stream", action="store_true",
+        help="assemble in a single pass with bounded memory")
+    output_mode.add_argument(
+        "--rom", action="store_true",
+        help="write a packed binary .rom image instead of a .hack file")
+    output_mode.add_argument(
+        "--object", action="store_true",
+        help="write a relocatable " + Linker.EXTENSION + " object file, "
+             "to be linked with Linker.py")
+    argument_parser.add_argument(
+        "--listing", action="store_true",
+        help="also write a .lst index from ROM addresses to source lines")
+    argument_parser.add_argument(
+        "--jobs", type=int, metavar="N",
+        help="assemble the files of a directory with N worker processes, "
+             "and print a throughput summary")
+    argument_parser.add_argument(
+        "--cache", nargs="?", const=DEFAULT_DIRECTORY,
+        metavar="DIR", help="restore unchanged files from a build cache "
+                            f"(default: {DEFAULT_DIRECTORY})")
+    argument_parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_MAX_SIZE,
+        metavar="BYTES", help="maximal size of the build cache")
+    arguments = argument_parser.parse_args()
+    if arguments.jobs is not None and arguments.jobs < 1:
+        argument_parser.error("--jobs must be at least 1")
+    if arguments.listing and (arguments.stream or arguments.object):
+        argument_parser.error(
+            "--listing is not supported with --stream or --object")
+    argument_path = os.path.abspath(arguments.path)
     if os.path.isdir(argument_path):
         files_to_assemble = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
     else:
         files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-        if extension.lower() != ".asm":
-            continue
-        output_path = filename + ".hack"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            assemble_file(input_file, output_file)
+    files_to_assemble = [
+        input_path for input_path in files_to_assemble
+        if os.path.splitext(input_path)[1].lower() == ".asm"]
+
+    cache = None
+    if arguments.cache is not None:
+        cache = BuildCache(arguments.cache, arguments.cache_size)
+    start_time = time.perf_counter()
+    results = assemble_files(files_to_assemble, arguments.jobs or 1,
+                             arguments.stream, arguments.rom, cache,
+                             arguments.listing, arguments.object)
+    elapsed = time.perf_counter() - start_time
+
+    failures = [(path, error) for path, _, _, _, error in results if error]
+    if cache is not None:
+        hits = sum(1 for result in results if result[3])
+        cache.record(hits, len(results) - len(failures) - hits,
+                     sum(result[2] for result in results))
+        cache.evict()
+    for path, error in failures:
+        print(f"{path}: {error}", file=sys.stderr)
+    if arguments.jobs is not None:
+        assembled = len(results) - len(failures)
+        instructions = sum(result[1] for result in results)
+        print(f"Assembled {assembled}/{len(results)} files, {instructions} "
+              f"instructions in {elapsed:.3f}s "
+              f"({assembled / elapsed:.1f} files/s, "
+              f"{instructions / elapsed:.0f} instructions/s)")
+    if failures:
+        sys.exit(1)
@@ -25,27 +25,60 @@ class Parser:
     and symbols). In addition, removes all white space and comments.
     """
 
-    def __init__(self, input_file: typing.TextIO) -> None:
+    def __init__(self, input_file: typing.TextIO,
+                 streaming: bool = False, keep_source: bool = False) -> None:
         """Opens the input file and gets ready to parse it.
 
         Args:
             input_file (typing.TextIO): input file.
+            streaming (bool): if True, commands are read from the input one
+                line at a time instead of being loaded into self.commands.
+            keep_source (bool): if True, also keeps the original lines in
+                self.source_lines, and the (1-based) line number of each
+                command in self.line_numbers.
         """
-        input_lines = input_file.read().replace(' ', '').splitlines()
+        self.line_index = 0
+        if streaming:
+            self.commands = None
+            self.command_stream = self.read_commands(input_file)
+            self.current_command = next(self.command_stream, "end")
+            return
+        text = input_file.read()
+        input_lines = text.replace(' ', '').splitlines()
         # remove spaces and split lines
         self.commands = [i.partition("/")[0] for i in input_lines if i and i[0] in FIRST_LETTERS] + ["end"]
         # remove comments and empty lines
         # "end" is the no more commands marker.
-        self.line_index = 0
+        if keep_source:
+            self.source_lines = text.splitlines()
+            self.line_numbers = [
+                number for number, i in enumerate(input_lines, 1)
+                if i and i[0] in FIRST_LETTERS]
         self.current_command = self.commands[0]
 
+    @staticmethod
+    def read_commands(input_file: typing.TextIO) -> typing.Iterator[str]:
+        """Lazily yields the commands of the input, one line at a time.
+        Applies exactly the same cleaning rules as the non-streaming parser.
+
+        Args:
+            input_file (typing.TextIO): input file.
+
+        Returns:
+            typing.Iterator[str]: the cleaned commands, in order.
+        """
+        for raw_line in input_file:
+            for line in raw_line.replace(' ', '').splitlines():
+                if line and line[0] in FIRST_LETTERS:
+                    yield line.partition("/")[0]
+
     def has_more_commands(self) -> bool:
         """Are there more commands in the input?
 
         Returns:
             bool: True if there are more commands, False otherwise.
         """
-        return self.commands[self.line_index] != "end"
+        return self.current_command != "end"
 
     def advance(self) -> None:
         """Reads the next command from the input and makes it the current command.
@@ -53,7 +86,10 @@ class Parser:
         """
         if self.has_more_commands():
             self.line_index += 1
-            self.current_command = self.commands[self.line_index]
+            if self.commands is None:
+                self.current_command = next(self.command_stream, "end")
+            else:
+                self.current_command = self.commands[self.line_index]
 
     def command_type(self) -> str:
         """
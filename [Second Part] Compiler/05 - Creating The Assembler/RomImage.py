@@ -0,0 +1,147 @@
+"""
+Packed binary ROM images.
+
+An image is a small header followed by the program words and an optional
+symbol section:
+
+    magic (4 bytes) | instruction count (uint32) | symbol section size (uint32)
+    words (instruction count * uint16)
+    symbol section ("<address> <symbol>\\n" lines, utf-8)
+
+All numbers are little-endian. A full 32K ROM takes 64KB instead of the 544KB
+of the textual .hack format, and can be memory-mapped instead of parsed.
+
+Usage: python3 RomImage.py <file.hack | file.rom>
+converts a .hack file to a .rom image and vice versa.
+"""
+import mmap
+import os
+import struct
+import sys
+import typing
+from array import array
+
+MAGIC = b"HROM"
+HEADER = struct.Struct("<4sII")  # magic, instruction count, symbols size
+EXTENSION = ".rom"
+
+
+def write_image(output_file: typing.BinaryIO, words: array,
+                symbols: typing.Optional[dict[str, int]] = None) -> None:
+    """Writes a packed ROM image.
+
+    Args:
+        output_file (typing.BinaryIO): writes the image to this file.
+        words (array): the program, as an array('H') of 16-bit words.
+        symbols (dict[str, int]): optional symbols to keep in the image.
+    """
+    symbol_section = "".join(
+        f"{address} {symbol}\n"
+        for symbol, address in (symbols or {}).items()).encode()
+    if sys.byteorder != "little":
+        words = array('H', words)
+        words.byteswap()
+    output_file.write(HEADER.pack(MAGIC, len(words), len(symbol_section)))
+    output_file.write(words.tobytes())
+    output_file.write(symbol_section)
+
+
+class RomImage:
+    """A read-only, memory-mapped view of a packed ROM image. Behaves like a
+    sequence of the program's 16-bit words."""
+
+    def __init__(self, path: str) -> None:
+        """Maps the image file into memory.
+
+        Args:
+            path (str): path of the image file.
+        """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, symbols_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a ROM image")
+        self.symbols_offset = HEADER.size + 2 * count
+        self.symbols_size = symbols_size
+        self.raw = memoryview(self.map)[HEADER.size:self.symbols_offset]
+        if sys.byteorder == "little":
+            self.words = self.raw.cast('H')
+        else:
+            self.words = array('H', self.raw)
+            self.words.byteswap()
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, address):
+        return self.words[address]
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self.words)
+
+    def __enter__(self) -> "RomImage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def symbols(self) -> dict[str, int]:
+        """
+        Returns:
+            dict[str, int]: the symbols stored in the image, if any.
+        """
+        section = self.map[self.symbols_offset:
+                           self.symbols_offset + self.symbols_size]
+        symbols = {}
+        for line in section.decode().splitlines():
+            address, symbol = line.split(" ", 1)
+            symbols[symbol] = int(address)
+        return symbols
+
+    def close(self) -> None:
+        """Unmaps the image and closes its file."""
+        for view in (getattr(self, "words", None), getattr(self, "raw", None)):
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+        self.file.close()
+
+
+def hack_to_image(input_file: typing.TextIO,
+                  output_file: typing.BinaryIO) -> None:
+    """Converts a textual .hack file into a packed ROM image.
+
+    Args:
+        input_file (typing.TextIO): the .hack file.
+        output_file (typing.BinaryIO): writes the image to this file.
+    """
+    write_image(output_file,
+                array('H', (int(line, 2) for line in input_file if line.strip())))
+
+
+def image_to_hack(image: RomImage, output_file: typing.TextIO) -> None:
+    """Converts a packed ROM image back into the textual .hack format.
+
+    Args:
+        image (RomImage): the image to convert.
+        output_file (typing.TextIO): writes the .hack lines to this file.
+    """
+    for word in image:
+        output_file.write(format(word, "016b") + "\n")
+
+
+if "__main__" == __name__:
+    if not len(sys.argv) == 2:
+        sys.exit("Invalid usage, please use: RomImage <file.hack | file.rom>")
+    filename, extension = os.path.splitext(os.path.abspath(sys.argv[1]))
+    if extension.lower() == ".hack":
+        with open(sys.argv[1], 'r') as input_file, \
+                open(filename + EXTENSION, 'wb') as output_file:
+            hack_to_image(input_file, output_file)
+    elif extension.lower() == EXTENSION:
+        with RomImage(sys.argv[1]) as image, \
+                open(filename + ".hack", 'w') as output_file:
+            image_to_hack(image, output_file)
+    else:
+        sys.exit("Invalid input, expected a .hack or a " + EXTENSION + " file")
@@ -26,8 +26,11 @@ class SymbolTable:
         """Creates a new symbol table initialized with all the predefined symbols
         and their pre-allocated RAM addresses, according to section 6.2.3 of the
         book.
+        The predefined symbols are shared by all tables and never modified:
+        new entries go to an overlay that shadows them, so tables are cheap to
+        create and independent of each other.
         """
-        self.table = SYMBOL_TABLE
+        self.table = {}  # the overlay of symbols added to this table
 
     def add_entry(self, symbol: str, address: int) -> None:
         """Adds the pair (symbol, address) to the table, or automatically
@@ -48,7 +51,7 @@ class SymbolTable:
         Returns:
             bool: True if the symbol is contained, False otherwise.
         """
-        return symbol in self.table
+        return symbol in self.table or symbol in SYMBOL_TABLE
 
     def get_address(self, symbol: str) -> int:
         """Returns the address associated with the symbol.
@@ -59,5 +62,6 @@ class SymbolTable:
         Returns:
             int: the address associated with the symbol.
         """
-        if self.contains(symbol):
+        if symbol in self.table:
             return self.table[symbol]
+        return SYMBOL_TABLE.get(symbol)
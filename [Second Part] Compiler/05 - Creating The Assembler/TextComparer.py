@@ -1,34 +1,192 @@
 
 """
 This Program created in order to compare two files and return the differences between them.
+
+The files are streamed rather than loaded: identical regions are skipped a
+whole block at a time, and only blocks that differ are compared line by line.
+Packed ROM images (see RomImage.py) are compared word by word, and can also be
+compared against .hack files.
+
+Usage: python3 TextComparer.py <file1> <file2> [-n N] [--quiet] [--output FILE]
+Exits with status 0 if the files are identical and 1 otherwise.
 """
 
+import argparse
+import itertools
 import sys
-import os
+import typing
+import RomImage
+
+BLOCK_SIZE = 64 * 1024
+RESYNC_SIZE = 4 * 1024  # identical bytes needed to go back to block skipping
+
 
 def compare_files(file1, file2):
     """
     Compare two files and return the differences between them.
     """
-    with open(file1, 'r') as f1, open(file2, 'r') as f2:
-        file1 = f1.readlines()
-        file2 = f2.readlines()
-    differences = []
-    for i, line in enumerate(file1):
-        if line != file2[i]:
-            differences.append((i, line, file2[i]))
-    return differences
+    return list(iter_differences(file1, file2))
+
+
+def iter_differences(file1: str, file2: str) -> typing.Iterator[tuple]:
+    """Lazily compares two files, so the caller can stop at any difference.
+
+    Args:
+        file1 (str): path of the first file.
+        file2 (str): path of the second file.
+
+    Returns:
+        typing.Iterator[tuple]: (index, line1, line2) for every differing line
+        (or ROM word), in order. index is the line number, which is also the
+        ROM address for .hack files. When one file is longer, the missing
+        lines of the other one are None.
+    """
+    if is_rom_image(file1) or is_rom_image(file2):
+        return iter_word_differences(file1, file2)
+    return iter_line_differences(file1, file2)
+
+
+def iter_line_differences(file1: str, file2: str) -> typing.Iterator[tuple]:
+    """Compares two text files, see iter_differences."""
+    with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
+        index = 0
+        while True:
+            # skip identical blocks, up to the last full line in them
+            start = f1.tell()
+            block1 = f1.read(BLOCK_SIZE)
+            block2 = f2.read(BLOCK_SIZE)
+            last_newline = block1.rfind(b"\n")
+            if block1 == block2 and last_newline != -1:
+                index += block1.count(b"\n")
+                f1.seek(start + last_newline + 1)
+                f2.seek(start + last_newline + 1)
+                continue
+            if not block1 and not block2:
+                return
+            # compare line by line, until the files are aligned again
+            f1.seek(start)
+            f2.seek(start)
+            identical_size = 0
+            while identical_size < RESYNC_SIZE:
+                line1 = f1.readline()
+                line2 = f2.readline()
+                if not line1 and not line2:
+                    return
+                if line1 == line2 and f1.tell() == f2.tell():
+                    identical_size += len(line1)
+                else:
+                    identical_size = 0
+                    if line1 != line2:
+                        yield index, decode_line(line1), decode_line(line2)
+                        if f1.tell() != f2.tell():
+                            yield from iter_unaligned_differences(
+                                f1, f2, index + 1)
+                            return
+                index += 1
+
+
+def iter_unaligned_differences(f1: typing.BinaryIO, f2: typing.BinaryIO,
+                               index: int) -> typing.Iterator[tuple]:
+    """Compares the rest of two files line by line, once their lines are no
+    longer at the same offsets (so blocks can't be skipped anymore)."""
+    for line1, line2 in itertools.zip_longest(f1, f2):
+        if line1 != line2:
+            yield index, decode_line(line1), decode_line(line2)
+        index += 1
+
+
+def decode_line(line: typing.Optional[bytes]) -> typing.Optional[str]:
+    """Returns the text of a line, without its line break."""
+    if not line:
+        return None
+    return line.rstrip(b"\r\n").decode(errors="replace")
+
+
+def is_rom_image(path: str) -> bool:
+    """Is the file at path a packed ROM image?"""
+    with open(path, 'rb') as input_file:
+        return input_file.read(len(RomImage.MAGIC)) == RomImage.MAGIC
+
+
+def iter_word_differences(file1: str, file2: str) -> typing.Iterator[tuple]:
+    """Compares two programs, where at least one is a packed ROM image and
+    the other is either a ROM image or a .hack file, see iter_differences.
+    Words are reported in the .hack format."""
+    if is_rom_image(file1) and is_rom_image(file2):
+        with RomImage.RomImage(file1) as image1, \
+                RomImage.RomImage(file2) as image2:
+            yield from iter_image_differences(image1, image2)
+        return
+    rom_path, hack_path = (file1, file2) if is_rom_image(file1) \
+        else (file2, file1)
+    with RomImage.RomImage(rom_path) as image, \
+            open(hack_path, 'r') as hack_file:
+        hack_words = (int(line, 2) for line in hack_file if line.strip())
+        words = (image, hack_words) if rom_path == file1 \
+            else (hack_words, image)
+        for index, (word1, word2) in enumerate(itertools.zip_longest(*words)):
+            if word1 != word2:
+                yield index, format_word(word1), format_word(word2)
+
+
+def iter_image_differences(image1: RomImage.RomImage,
+                           image2: RomImage.RomImage) -> typing.Iterator[tuple]:
+    """Compares two ROM images, skipping identical blocks of words."""
+    block_words = BLOCK_SIZE // 2
+    common_length = min(len(image1), len(image2))
+    for start in range(0, common_length, block_words):
+        end = min(start + block_words, common_length)
+        if image1.raw[2 * start:2 * end] == image2.raw[2 * start:2 * end]:
+            continue
+        for index in range(start, end):
+            if image1[index] != image2[index]:
+                yield index, format_word(image1[index]), \
+                    format_word(image2[index])
+    for index in range(common_length, max(len(image1), len(image2))):
+        yield index, format_word(image1[index] if index < len(image1) else None), \
+            format_word(image2[index] if index < len(image2) else None)
+
+
+def format_word(word: typing.Optional[int]) -> typing.Optional[str]:
+    """Returns a ROM word in the .hack format."""
+    return None if word is None else format(word, "016b")
+
 
 if __name__ == "__main__":
-    with open('differences.txt', 'w') as f:
-        for difference in compare_files(sys.argv[1], sys.argv[2]):
-            f.write(f"Line {difference[0]}: {difference[1]} {difference[2]}")
-    # if the two files are identical, the differences.txt file will be empty,
+    argument_parser = argparse.ArgumentParser(prog="TextComparer")
+    argument_parser.add_argument("file1")
+    argument_parser.add_argument("file2")
+    argument_parser.add_argument(
+        "-n", "--max-differences", type=int, default=10, metavar="N",
+        help="report at most the first N differences (0 for all)")
+    argument_parser.add_argument(
+        "--quiet", action="store_true",
+        help="print nothing and stop at the first difference, "
+             "only the exit status tells if the files are identical")
+    argument_parser.add_argument(
+        "--output", metavar="FILE",
+        help="also write the reported differences to FILE")
+    arguments = argument_parser.parse_args()
+
+    differences = iter_differences(arguments.file1, arguments.file2)
+    if arguments.quiet:
+        sys.exit(0 if next(differences, None) is None else 1)
+    if arguments.max_differences:
+        differences = itertools.islice(differences, arguments.max_differences)
+    report = [f"Line {index}: {'<missing>' if line1 is None else line1} "
+              f"{'<missing>' if line2 is None else line2}\n"
+              for index, line1, line2 in differences]
+    sys.stdout.writelines(report)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.writelines(report)
+    # if the two files are identical, nothing is reported,
     # and the program will print "Files are identical"
-    # if the files are different, the differences.txt file will contain the differences
+    # if the files are different, the first differences are reported
     # and the program will print "Files are different"
 
-    if os.stat('differences.txt').st_size == 0:
+    if not report:
         print("Files are identical")
     else:
         print("Files are different")
+        sys.exit(1)
@@ -0,0 +1,84 @@
+"""
+Measures the translation time of a large VM corpus, made of many copies of
+the .vm files of a program, in its two phases: parsing the commands into the
+compact IR (see Parser.compile), and writing the assembly code.
+
+Usage: python Benchmark.py <path> [--copies N] [--rounds R]
+"""
+import argparse
+import io
+import os
+import time
+from CodeWriter import CodeWriter
+from Parser import Parser
+
+
+def make_corpus(input_paths: list[str], copies: int) -> str:
+    """
+    Args:
+        input_paths (list[str]): the .vm files of a program.
+        copies (int): the number of copies of the program in the corpus.
+
+    Returns:
+        str: the corpus, as the text of a single .vm file.
+    """
+    program = ""
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            program += input_file.read() + "\n"
+    return program * copies
+
+
+def benchmark(corpus: str, **options: bool) -> tuple[float, float, int]:
+    """Translates a corpus once.
+
+    Args:
+        corpus (str): the text of a .vm file.
+        **options (bool): translation options, see CodeWriter.
+
+    Returns:
+        tuple[float, float, int]: the seconds spent parsing and writing, and
+        the number of commands.
+    """
+    start = time.perf_counter()
+    parser = Parser(io.StringIO(corpus))
+    opcodes, operands = parser.compile()
+    parsed = time.perf_counter()
+    with open(os.devnull, 'w') as output_file:
+        code_writer = CodeWriter(output_file, **options)
+        code_writer.set_file_name("Corpus.vm")
+        code_writer.write_commands(zip(opcodes, operands))
+        code_writer.close()
+    written = time.perf_counter()
+    return parsed - start, written - parsed, len(opcodes)
+
+
+if "__main__" == __name__:
+    argument_parser = argparse.ArgumentParser(prog="Benchmark")
+    argument_parser.add_argument("path", help="a .vm file or a directory")
+    argument_parser.add_argument(
+        "--copies", type=int, default=500,
+        help="the number of copies of the program in the corpus "
+             "(default: 500)")
+    argument_parser.add_argument(
+        "--rounds", type=int, default=3,
+        help="the number of times the corpus is translated, the fastest "
+             "round is reported (default: 3)")
+    arguments = argument_parser.parse_args()
+    argument_path = os.path.abspath(arguments.path)
+    if os.path.isdir(argument_path):
+        input_paths = [os.path.join(argument_path, filename)
+                       for filename in sorted(os.listdir(argument_path))
+                       if os.path.splitext(filename)[1].lower() == ".vm"]
+    else:
+        input_paths = [argument_path]
+
+    corpus = make_corpus(input_paths, arguments.copies)
+    rounds = [benchmark(corpus) for _ in range(arguments.rounds)]
+    commands = rounds[0][2]
+    parsing = min(parse_time for parse_time, _, _ in rounds)
+    writing = min(write_time for _, write_time, _ in rounds)
+    print(f"Corpus: {commands} commands, {arguments.copies} copies of "
+          f"{len(input_paths)} files")
+    print(f"Parsing: {parsing:.2f} s ({commands / parsing:,.0f} commands/s)")
+    print(f"Writing: {writing:.2f} s ({commands / writing:,.0f} commands/s)")
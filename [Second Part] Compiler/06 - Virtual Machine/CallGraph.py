@@ -0,0 +1,95 @@
+"""
+Whole-program analysis of the functions of a VM program: which function
+calls which, and which functions can be reached from Sys.init.
+"""
+import typing
+from Parser import Parser
+
+ROOT_FUNCTION = "Sys.init"  # called by the bootstrap code
+
+Command = list[str]
+
+
+def split_functions(commands: list[Command]) -> dict[str, list[Command]]:
+    """
+    Args:
+        commands (list[Command]): the commands of a file, as split by the
+            Parser, without the end marker.
+
+    Returns:
+        dict[str, list[Command]]: the commands of every function, from its
+        "function" command up to the next one. Commands before the first
+        function are kept under the empty name.
+    """
+    functions = {"": []}
+    body = functions[""]
+    for command in commands:
+        if command[0] == "function":
+            body = functions[command[1]] = []
+        body.append(command)
+    return functions
+
+
+def call_graph(input_paths: list[str]) -> dict[str, set[str]]:
+    """Parses a program and builds its call graph.
+
+    Args:
+        input_paths (list[str]): the .vm files of the program.
+
+    Returns:
+        dict[str, set[str]]: the functions each function calls.
+    """
+    graph = {}
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            commands = Parser(input_file).commands[:-1]
+        for name, body in split_functions(commands).items():
+            if name:
+                graph[name] = {command[1] for command in body
+                               if command[0] == "call"}
+    return graph
+
+
+def reachable_functions(graph: dict[str, set[str]],
+                        root: str = ROOT_FUNCTION) -> set[str]:
+    """
+    Args:
+        graph (dict[str, set[str]]): a call graph.
+        root (str): the function the program starts from.
+
+    Returns:
+        set[str]: the functions that may be called when the program runs.
+    """
+    if root not in graph:
+        raise ValueError(f"{root} is not defined")
+    reachable = {root}
+    pending = [root]
+    while pending:
+        for callee in graph.get(pending.pop(), ()):
+            if callee not in reachable:
+                reachable.add(callee)
+                pending.append(callee)
+    return reachable
+
+
+def keep_functions(parser: Parser, functions: typing.Container[str]) -> list[str]:
+    """Removes the functions that are not in functions from the commands of
+    a parser that did not advance yet.
+
+    Args:
+        parser (Parser): the parser of a file.
+        functions (typing.Container[str]): the functions to keep.
+
+    Returns:
+        list[str]: the removed functions.
+    """
+    kept = []
+    removed = []
+    for name, body in split_functions(parser.commands[:-1]).items():
+        if not name or name in functions:
+            kept.extend(body)
+        else:
+            removed.append(name)
+    parser.commands = kept + [parser.commands[-1]]  # keeps the end marker
+    parser.current_command = parser.commands[parser.counter]
+    return removed
@@ -1,4 +1,7 @@
+import os
+import re
 import typing
+from Parser import OPCODES
 
 """ Common Assembly Code for Arithmetic Commands"""
 
@@ -34,6 +37,39 @@ LT = POP_Y + HANDLE_DIFFERENT_SIGNS + DXY + JUMP_IF_NOT_LOWER + \
 
 EQ = POP_Y + DXY + SET_FALSE_AND_JUMP_IF_NOT_EQUAL + SET_TRUE + END
 
+COMPARISON_LABELS = re.compile("SUBTRACT|Y_POSITIVE|LOWER_THAN|BIGGER_THAN|END")
+
+# Arithmetic on the top of the stack when it is cached in D (see CodeWriter):
+# binary commands combine D with the value under it, unary commands change D.
+CACHED_BINARY_DICT = {"add": "D=D+M\n",
+                      "sub": "D=M-D\n",
+                      "and": "D=D&M\n",
+                      "or": "D=D|M\n"
+                      }
+CACHED_UNARY_DICT = {"neg": "D=-D\n",
+                     "not": "D=!D\n",
+                     "shiftleft": "D=D<<\n",
+                     "shiftright": "D=D>>\n",
+                     "<<": "D=D<<\n",
+                     ">>": "D=D>>\n"
+                     }
+POP_TO_D = "@SP\nAM=M-1\nD=M\n"
+
+# Arithmetic on stack slots addressed relative to SP (see CodeWriter), after
+# A is set to the address of the top of the stack.
+RELATIVE_BINARY_DICT = {"add": "D=M\nA=A-1\nM=M+D\n",
+                        "sub": "D=M\nA=A-1\nM=M-D\n",
+                        "and": "D=M\nA=A-1\nM=M&D\n",
+                        "or": "D=M\nA=A-1\nM=M|D\n"
+                        }
+RELATIVE_UNARY_DICT = {"neg": "M=-M\n",
+                       "not": "M=!M\n",
+                       "shiftleft": "M=M<<\n",
+                       "shiftright": "M=M>>\n",
+                       "<<": "M=M<<\n",
+                       ">>": "M=M>>\n"
+                       }
+
 POP_Y_AND_POINT_TO_X = POP_Y + "A=A-1\n"
 POINT_TO_Y = "@SP\nA=M-1\n"
 
@@ -47,7 +83,9 @@ ART_DICT = {"gt": GT,
             "and": POP_Y_AND_POINT_TO_X + "M=M&D\n",
             "or": POP_Y_AND_POINT_TO_X + "M=M|D\n",
             "shiftleft": POINT_TO_Y + "M=M<<\n",
-            "shiftright": POINT_TO_Y + "M=M>>\n"
+            "shiftright": POINT_TO_Y + "M=M>>\n",
+            "<<": POINT_TO_Y + "M=M<<\n",  # the Jack compiler writes the
+            ">>": POINT_TO_Y + "M=M>>\n"   # shift operators as is
             }
 
 PUSH_TEMPLATE = "\n@SP\nA=M\nM=D\n@SP\nM=M+1\n"
@@ -77,6 +115,10 @@ SEGMENT_DICT = {"SP": "SP",
                 "static": "STATIC"
                 }
 
+# The "inline" segment holds the arguments and locals of inlined functions
+# (see Inliner.py) in global variables.
+INLINE_VARIABLE = "$inline."
+
 SET_LOCAL_TO_ZERO = '@0\nD=A\nM=M+1\nA=M-1\nM=D\n'
 
 # Macros for compile return:
@@ -85,64 +127,374 @@ SET_NEW = "D=M\n@SP\nM=M+1\nA=M-1\nM=D\n"
 
 RETURN_OLD = "\nM=M-1\nA=M\nD=M\n"
 
+# Shared call and return routines, written once after the bootstrap code.
+# A call site passes the function address in D, the return address in R14
+# and 5 + n_args in R13, and then jumps to CALL_ROUTINE.
+# A return is just a jump to RETURN_ROUTINE.
+CALL_LABEL = "$call"
+RETURN_LABEL = "$return"
+PUSH_D = "@SP\nM=M+1\nA=M-1\nM=D\n"
+
+CALL_ROUTINE = "(" + CALL_LABEL + ")\n@R15\nM=D\n" + \
+    "@R14\nD=M\n" + PUSH_D + \
+    "@LCL\n" + SET_NEW + "@ARG\n" + SET_NEW + \
+    "@THIS\n" + SET_NEW + "@THAT\n" + SET_NEW + \
+    "@SP\nD=M\n@R13\nD=D-M\n@ARG\nM=D\n" + \
+    "@SP\nD=M\n@LCL\nM=D\n" + \
+    "@R15\nA=M\n0;JMP\n"
+
+RETURN_ROUTINE = "(" + RETURN_LABEL + ")\n" + \
+    "@LCL\nD=M\n@R13\nM=D\n" + \
+    "@5\nA=D-A\nD=M\n@R14\nM=D\n" + \
+    "@SP\nAM=M-1\nD=M\n@ARG\nA=M\nM=D\n" + \
+    "@ARG\nD=M+1\n@SP\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@THAT\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@THIS\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@ARG\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@LCL\nM=D\n" + \
+    "@R14\nA=M\n0;JMP\n"
+
+# Shared comparison routines: a comparison passes its return address in D
+# and jumps to the routine of the command, which keeps it in R15.
+COMPARISON_ROUTINE = "($%s)\n@R15\nM=D\n%s@R15\nA=M\n0;JMP\n"
+
+
+def rename_labels(code: str, prefix: str, suffix: str = "") -> str:
+    """
+    Args:
+        code (str): the code of a comparison (GT, LT or EQ).
+        prefix (str): makes the labels of this copy of the code unique.
+        suffix (str): also added to the labels.
+
+    Returns:
+        str: the code, with prefix and suffix added to all its labels.
+    """
+    return COMPARISON_LABELS.sub(
+        lambda label: prefix + label.group() + suffix, code)
+
+
+def signed_digits(constant: int) -> list[int]:
+    """
+    Args:
+        constant (int): a positive number.
+
+    Returns:
+        list[int]: the digits of constant in base 2 with digits -1, 0 and 1,
+        from the most significant one, which is 1, such that no two adjacent
+        digits are non-zero (the non-adjacent form). It has the fewest
+        non-zero digits, e.g. 7 is 8 - 1.
+    """
+    digits = []
+    while constant:
+        digit = 2 - (constant & 3) if constant & 1 else 0  # 1 or -1 if odd
+        digits.append(digit)
+        constant = (constant - digit) >> 1
+    return digits[::-1]
+
+
+# Templates of the commands that are written with parameters, compiled once.
+# Their slots are filled by str.format.
+
+# A call pushes the return label, LCL, ARG, THIS and THAT, sets
+# ARG = SP - 5 - n_args and LCL = SP, and jumps to the function.
+# {0} is the return label, {1} is 5 + n_args and {2} is the called function.
+CALL_TEMPLATE = "@{0}\nD=A\n@SP\nM=M+1\nA=M-1\nM=D\n" + \
+    "@R1\n" + SET_NEW + \
+    "@R2\n" + SET_NEW + \
+    "@R3\n" + SET_NEW + \
+    "@R4\n" + SET_NEW + \
+    "@SP\nD=M\n@{1}\nD=D-A\n@R2\nM=D\n" + \
+    "@SP\nD=M\n@R1\nM=D\n" + \
+    "@{2}\n0;JMP\n({0})\n"
+SHARED_CALL_TEMPLATE = "@{0}\nD=A\n@R14\nM=D\n@{1}\nD=A\n@R13\nM=D\n" + \
+    "@{2}\nD=A\n@" + CALL_LABEL + "\n0;JMP\n({0})\n"
+
+# A return saves the frame (LCL) in R13 and the return address (*(frame-5))
+# in R14, pops the return value to *ARG, sets SP to ARG + 1, restores THAT,
+# THIS, ARG and LCL from the frame, and jumps to the return address.
+RETURN_SAVE_FRAME = "@R1\nD=M\n@R13\nM=D\n@5\nD=D-A\nA=D\nD=M\n@R14\nM=D\n"
+RETURN_RESTORE = "@ARG\nD=M+1\n@SP\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@THAT\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@THIS\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@ARG\nM=D\n" + \
+    "@R13" + RETURN_OLD + "@LCL\nM=D\n" + \
+    "@R14\nA=M\n0;JMP\n"
+
+# A tail call, a call followed by a return, reuses the frame of the current
+# function: the saved frame of its caller (the return address, LCL, ARG, THIS
+# and THAT at LCL-5 to LCL-1) is kept in the temp segment, which is not
+# preserved across calls, the arguments are moved down to ARG, the saved frame
+# is written after them, LCL and SP are set after it, and the called function
+# is jumped to. The called function returns directly to the caller of the
+# current function.
+TAIL_CALL_SAVE_FRAME = "".join(
+    "@LCL\nD=M\n@" + str(5 - i) + "\nA=D-A\nD=M\n@" + str(5 + i) + "\nM=D\n"
+    for i in range(4)) + "@LCL\nA=M-1\nD=M\n@9\nM=D\n"
+# R13 points to the next argument to move, and R14 to its destination.
+TAIL_CALL_MOVE_ARGUMENT = "@R13\nAM=M+1\nA=A-1\nD=M\n" + \
+    "@R14\nAM=M+1\nA=A-1\nM=D\n"
+TAIL_CALL_RESTORE_FRAME = "".join(
+    "@" + str(5 + i) + "\nD=M\n@R14\nAM=M+1\nA=A-1\nM=D\n"
+    for i in range(5)) + "@R14\nD=M\n@SP\nM=D\n@LCL\nM=D\n"
+
+# {0} is the current function and {1} is the counter of the comparison.
+COMPARISON_TEMPLATES = {
+    command: rename_labels(ART_DICT[command], "{0}$", "_" + command + "_{1}")
+    for command in ("eq", "gt", "lt")}
+
+# Profile counters (see Profiler.py) are kept at the bottom of the stack
+# segment: the bootstrap of a profiled program starts the stack right after
+# them (see Main.write_bootstrap), so nothing is reserved without --profile.
+# Every function has a counter of calls and a counter of instructions, and
+# every counter is two words: the count modulo 2^15, and the count divided by
+# 2^15.
+PROFILE_BASE = 256
+PROFILE_WORDS = 4  # words of the counters of every function
+MAX_PROFILED_FUNCTIONS = 256  # leaves 768 words of the stack segment
+
+
+def count_code(address: int, amount: int, label: str) -> str:
+    """
+    Args:
+        address (int): the address of a profile counter.
+        amount (int): a number from 1 to 32767.
+        label (str): a unique label for the code.
+
+    Returns:
+        str: assembly code that adds amount to the counter. It runs 4
+        instructions, or 6 if amount is not 1, and 6 more when the count
+        modulo 2^15 wraps.
+    """
+    if amount == 1:
+        add = "@" + str(address) + "\nMD=M+1\n"
+    else:
+        add = "@" + str(amount) + "\nD=A\n@" + str(address) + "\nMD=D+M\n"
+    return add + "@" + label + "\nD;JGE\n" + \
+        "@32767\nD=A\n@" + str(address) + "\nM=D&M\n" + \
+        "@" + str(address + 1) + "\nM=M+1\n(" + label + ")\n"
+
+
+# Written code is collected in chunks, and is written to the output stream
+# when this many chunks were collected (checked after every command, see
+# write_commands) and at the end of the translation.
+CHUNKS_PER_WRITE = 16384
 
 
 class CodeWriter:
     """Translates VM commands into Hack assembly code."""
 
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    def __init__(self, output_stream: typing.TextIO,
+                 shared_calls: bool = False,
+                 shared_comparisons: bool = False,
+                 cache_top: bool = False,
+                 static_depth: bool = False,
+                 profile: typing.Optional[dict[str, int]] = None,
+                 profile_instructions: bool = False) -> None:
         """Initializes the CodeWriter.
 
+        The code is collected in memory and written to output_stream in large
+        chunks, so close should be called at the end of the translation.
+
         Args:
             output_stream (typing.TextIO): output stream.
+            shared_calls (bool): if this is True, calls and returns jump to
+                shared routines (see write_shared_routines) instead of
+                inlining the whole calling convention at every call site.
+            shared_comparisons (bool): if this is True, eq, gt and lt jump to
+                shared routines instead of inlining the comparison.
+            cache_top (bool): if this is True, the top of the stack is kept
+                in D between commands of a basic block, and only written to
+                the stack before labels, branches, calls, returns and
+                commands that need the whole stack in memory.
+            static_depth (bool): if this is True, stack slots are addressed
+                relative to SP by their depth, which is known within a basic
+                block, and SP is only updated at the end of the block.
+                Cannot be used together with cache_top.
+            profile (dict[str, int]): if given, maps functions to the index
+                of their counters (see PROFILE_BASE), and every entry to
+                these functions is counted.
+            profile_instructions (bool): if this is True, the instructions
+                run by the functions of profile are also counted: when
+                control enters a straight-line segment of code (after a
+                label, a branch or a call), the number of its instructions
+                is added to the counter of the function. Code that jumps
+                within a command (comparisons and divisions) is counted as a
+                whole, and the shared routines are not counted.
         """
+        if cache_top and static_depth:
+            raise ValueError("cache_top and static_depth cannot be combined")
+        if profile_instructions and profile is None:
+            raise ValueError("profile_instructions needs a profile")
+        if profile is not None and len(profile) > MAX_PROFILED_FUNCTIONS:
+            raise ValueError(f"cannot profile more than "
+                             f"{MAX_PROFILED_FUNCTIONS} functions")
         self.output_stream = output_stream
+        self.chunks = []  # written code that was not written to output_stream
+        self.write = self.chunks.append
+        # expansions of push, pop and loads of values, by their arguments and
+        # the current file
+        self.push_pop_cache = {}
+        self.load_cache = {}
+        self.shared_calls = shared_calls
+        self.shared_comparisons = shared_comparisons
+        self.cache_top = cache_top
+        self.top_in_d = False  # is the top of the stack only in D?
+        self.static_depth = static_depth
+        self.offset = 0  # pushes minus pops that were not added to SP yet
+        self.profile = profile
+        self.profile_instructions = profile_instructions
+        # the chunk that holds the count of the open segment, and its function
+        self.segment = None
         self.current_file = ""
         self.current_function = ""
         self.current_return = 0
         self.counter = 0  # counter is used for counting arithmetic commands
                           # used to differentiate between their labels.
 
-        # The navigator is used in order to translate parser command into actual code.
-        self.navigator = [
-            {
-                "C_RETURN": self.write_return
-            },
-            {
-                "C_ARITHMETIC": self.write_arithmetic,
-                "C_LABEL": self.write_label,
-                "C_GOTO": self.write_goto,
-                "C_IF": self.write_if,
-            },
-
-            {
-                "C_FUNCTION": self.write_function,
-                "C_CALL": self.write_call,
-            },
-
-            {
-               "C_PUSH": self.write_push_pop,
-                "C_POP": self.write_push_pop, 
-            }
-        ]
-
-    def get_method_and_index(self, command_type: str):
-        """ This function return the right method to call"""
-        for i in range(4):
-            if command_type in self.navigator[i]:
-                return self.navigator[i][command_type], i
-
+        # The dispatch table translates the compact IR of the Parser (see
+        # Parser.compile): the method at the index of every opcode is called
+        # with the operands of the command.
+        methods = {
+            "C_ARITHMETIC": self.write_arithmetic,
+            "C_PUSH": self.write_push_pop,
+            "C_POP": self.write_push_pop,
+            "C_LABEL": self.write_label,
+            "C_GOTO": self.write_goto,
+            "C_IF": self.write_if,
+            "C_FUNCTION": self.write_function,
+            "C_CALL": self.write_call,
+            "C_RETURN": self.write_return,
+            # fused commands written by Peephole, called with their
+            # arguments as strings
+            "C_MOVE": self.write_move,
+            "C_IF_NOT": self.write_if_not,
+            "C_LOAD_THAT": self.write_load_that,
+            "C_STORE_THAT": self.write_store_that,
+            "C_MULTIPLY_CONSTANT": self.write_multiply_constant,
+            "C_DIVIDE_CONSTANT": self.write_divide_constant,
+            "C_TAIL_CALL": self.write_tail_call,
+        }
+        self.dispatch = [methods[command_type] for command_type in OPCODES]
 
     def set_file_name(self, filename: str) -> None:
         """Informs the code writer that the translation of a new VM file is 
         started.
 
+        Generated labels are scoped by the file: they are prefixed by the
+        current function, or by the file name before the first function, and
+        their counters start over in every file. So every file is translated
+        the same way, whether or not other files were translated before it
+        by the same CodeWriter.
+
         Args:
             filename (str): The name of the VM file.
         """
         self.current_file = filename
+        self.current_function = os.path.splitext(filename)[0]
+        self.current_return = 0
+        self.counter = 0
         return
 
+    def write_chunks(self) -> None:
+        """Writes the collected code to the output stream."""
+        self.output_stream.write("".join(self.chunks))
+        self.chunks.clear()
+
+    def write_full_chunks(self) -> None:
+        """Writes the collected code to the output stream, except for the
+        open segment (see profile_instructions), whose count is written in
+        its first chunk when it closes."""
+        if self.segment is None:
+            self.write_chunks()
+            return
+        start, function = self.segment
+        self.output_stream.write("".join(self.chunks[:start]))
+        del self.chunks[:start]
+        self.segment = (0, function)
+
+    def write_commands(
+            self, commands: typing.Iterable[tuple[int, tuple]]) -> None:
+        """Translates commands in the compact IR (see Parser.compile), and
+        writes the collected code whenever CHUNKS_PER_WRITE chunks were
+        collected, so the translation of a long input takes constant memory.
+
+        Args:
+            commands (typing.Iterable[tuple[int, tuple]]): the opcode and the
+                operands of every command.
+        """
+        dispatch = self.dispatch
+        chunks = self.chunks
+        for opcode, operands in commands:
+            dispatch[opcode](*operands)
+            if len(chunks) >= CHUNKS_PER_WRITE:
+                self.write_full_chunks()
+
+    def close(self) -> None:
+        """Ends the translation: brings the stack to memory and writes all
+        the collected code to the output stream."""
+        self.flush()
+        self.close_segment()
+        self.write_chunks()
+
+    def close_segment(self) -> None:
+        """Writes the count of the instructions of the open segment of code
+        in its chunk (see profile_instructions)."""
+        if self.segment is None:
+            return
+        start, function = self.segment
+        self.segment = None
+        code = "".join(self.chunks[start + 1:])
+        instructions = code.count("\n") - code.count("(")  # without labels
+        if instructions:
+            self.chunks[start] = count_code(
+                PROFILE_BASE + PROFILE_WORDS * self.profile[function] + 2,
+                instructions, function + "$profile." + str(self.counter))
+            self.counter += 1
+
+    def open_segment(self) -> None:
+        """Closes the open segment of code, and starts a new one if the
+        instructions of the current function are counted."""
+        self.close_segment()
+        if self.profile_instructions and self.current_function in self.profile:
+            self.segment = (len(self.chunks), self.current_function)
+            self.write("")  # replaced by the count when the segment closes
+
+    def flush(self) -> None:
+        """Brings the stack to memory: writes the top of the stack from D to
+        the stack if it is cached there, and adds the pending offset to SP.
+        D is kept."""
+        if self.top_in_d:
+            self.write(PUSH_D)
+            self.top_in_d = False
+        if self.offset:
+            self.write(self.update_sp(self.offset))
+            self.offset = 0
+
+    @staticmethod
+    def update_sp(offset: int) -> str:
+        """
+        Args:
+            offset (int): the number of slots to add to SP.
+
+        Returns:
+            str: assembly code that adds offset to SP and keeps D.
+        """
+        if abs(offset) <= 3:
+            return "@SP\n" + ("M=M+1\n" if offset > 0 else "M=M-1\n") * abs(offset)
+        return "@R13\nM=D\n@" + str(abs(offset)) + "\nD=A\n@SP\n" + \
+               ("M=M+D\n" if offset > 0 else "M=M-D\n") + "@R13\nD=M\n"
+
+    def point_to_slot(self, offset: int) -> str:
+        """
+        Args:
+            offset (int): a stack slot, relative to SP in memory.
+
+        Returns:
+            str: assembly code that sets A to the address of the slot and
+            keeps D.
+        """
+        return "@SP\nA=M\n" + ("A=A+1\n" if offset > 0 else "A=A-1\n") * abs(offset)
+
     def write_arithmetic(self, command: str) -> None:
         """Writes assembly code that is the translation of the given 
         arithmetic command. For the commands eq, lt, gt, you should correctly
@@ -152,17 +504,40 @@ class CodeWriter:
         Args:
             command (str): an arithmetic command.
         """
-        assembly_code_to_write = ART_DICT[command]
-        for label in {"SUBTRACT", "Y_POSITIVE", "LOWER_THAN", "BIGGER_THAN", "END"}:
-            # replace is used to different between commands labels
-            assembly_code_to_write = assembly_code_to_write.replace(
-                    label, label + "_" + command + "_" + str(self.counter))
-            # also replaced in a debugging friendly way
-
+        if self.cache_top and command in CACHED_BINARY_DICT:
+            if not self.top_in_d:
+                self.write(POP_TO_D)
+            self.write("@SP\nAM=M-1\n" + CACHED_BINARY_DICT[command])
+            self.top_in_d = True
+            return
+        if self.top_in_d and command in CACHED_UNARY_DICT:
+            self.write(CACHED_UNARY_DICT[command])
+            return
+        if self.static_depth and command in RELATIVE_BINARY_DICT:
+            self.write(self.point_to_slot(self.offset - 1) +
+                       RELATIVE_BINARY_DICT[command])
+            self.offset -= 1
+            return
+        if self.static_depth and command in RELATIVE_UNARY_DICT:
+            self.write(self.point_to_slot(self.offset - 1) +
+                       RELATIVE_UNARY_DICT[command])
+            return
+        self.flush()
+        if command not in ("eq", "gt", "lt"):
+            self.write(ART_DICT[command])
+            return
+        if self.shared_comparisons:
+            label = self.current_function + "$" + command + "." + str(self.counter)
+            self.write("@" + label + "\nD=A\n@$" + command +
+                       "\n0;JMP\n(" + label + ")\n")
+        else:
+            # labels are made unique by the function name and the counter
+            self.write(COMPARISON_TEMPLATES[command].format(
+                self.current_function, self.counter))
         self.counter += 1  # increment counter
-        self.output_stream.write(assembly_code_to_write)
 
-    def write_push_pop(self, command: str, segment: str, index: int) -> None:
+    def write_push_pop(self, command: str, segment: str, index: int,
+                       file: typing.Optional[str] = None) -> None:
         """Writes assembly code that is the translation of the given 
         command, where command is either C_PUSH or C_POP.
 
@@ -170,20 +545,113 @@ class CodeWriter:
             command (str): "C_PUSH" or "C_POP".
             segment (str): the memory segment to operate on.
             index (int): the index in the memory segment.
+            file (str): the VM file whose static segment is used, if it is
+                not the current file (in functions inlined from other files).
         """
-        if segment == "constant":  # translation to simple constant
-            self.output_stream.write("@" + str(index) + PUSH_POP_DICT_CONST[command])
+        if file is not None:
+            current_file, self.current_file = self.current_file, file
+            self.write_push_pop(command, segment, index)
+            self.current_file = current_file
+            return
+        if self.cache_top:
+            self.write_cached_push_pop(command, segment, index)
             return
+        if self.static_depth:
+            self.write_relative_push_pop(command, segment, index)
+            return
+        # the translation only depends on the command and the file, so it is
+        # expanded once for every command
+        key = (command, segment, index, self.current_file)
+        code = self.push_pop_cache.get(key)
+        if code is None:
+            code = self.push_pop_cache[key] = self.translate_push_pop(
+                command, segment, index)
+        self.write(code)
+
+    def translate_push_pop(self, command: str, segment: str,
+                           index: int) -> str:
+        """
+        Args:
+            command (str): "push" or "pop".
+            segment (str): the memory segment to operate on.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: the plain translation of the command, through the stack in
+            memory.
+        """
+        if segment == "constant":  # translation to simple constant
+            return "@" + str(index) + PUSH_POP_DICT_CONST[command]
+        elif segment in ["static", "inline"]:  # translation to a variable
+            variable = "@" + self.direct_address(segment, index)
+            return variable + (PUSH if command == "push" else "\nD=A" + POP)
         elif segment in ["pointer", "temp"]:  # translation to pointed segment
             index, segment = self.handle_pointer_and_temp(index, segment)
             command_adaptor = "\nA=A+D" if command == "push" else "\nD=A+D"
         else:
             command_adaptor = "\nA=M+D" if command == "push" else "\nD=M+D"
-        self.output_stream.write("@" + str(index) + "\nD=A\n@" +
-                                 SEGMENT_DICT[segment] + command_adaptor +
-                                 PUSH_POP_DICT_NOT_CONST[command])
         # Note That command_adaptor is used because different commands needs
         # different commands in this place.
+        return "@" + str(index) + "\nD=A\n@" + SEGMENT_DICT[segment] + \
+               command_adaptor + PUSH_POP_DICT_NOT_CONST[command]
+
+    def write_cached_push_pop(self, command: str, segment: str,
+                              index: int) -> None:
+        """Writes a push or a pop when the top of the stack is cached in D:
+        a push flushes the previous top and loads the new one to D, and a pop
+        stores D.
+
+        Args:
+            command (str): "push" or "pop".
+            segment (str): the memory segment to operate on.
+            index (int): the index in the memory segment.
+        """
+        if command == "push":
+            self.flush()
+            self.write(self.load_value(segment, index))
+            self.top_in_d = True
+            return
+        if not self.top_in_d:
+            self.write(POP_TO_D)
+        self.top_in_d = False
+        address = self.direct_address(segment, index)
+        if address is not None:
+            self.write("@" + address + "\nM=D\n")
+        elif index <= 3:
+            self.write("@" + SEGMENT_DICT[segment] + "\nA=M\n" +
+                       "A=A+1\n" * index + "M=D\n")
+        else:
+            self.write(
+                "@R13\nM=D\n@" + str(index) + "\nD=A\n@" + SEGMENT_DICT[segment] +
+                "\nD=M+D\n@R14\nM=D\n@R13\nD=M\n@R14\nA=M\nM=D\n")
+
+    def write_relative_push_pop(self, command: str, segment: str,
+                                index: int) -> None:
+        """Writes a push or a pop that addresses the stack slot relative to
+        SP, and leaves updating SP to the end of the basic block.
+
+        Args:
+            command (str): "push" or "pop".
+            segment (str): the memory segment to operate on.
+            index (int): the index in the memory segment.
+        """
+        if command == "push":
+            self.write(self.load_value(segment, index) +
+                       self.point_to_slot(self.offset) + "M=D\n")
+            self.offset += 1
+            return
+        load = self.point_to_slot(self.offset - 1) + "D=M\n"
+        self.offset -= 1
+        address = self.direct_address(segment, index)
+        if address is not None:
+            self.write(load + "@" + address + "\nM=D\n")
+        elif index <= 3:
+            self.write(load + "@" + SEGMENT_DICT[segment] +
+                       "\nA=M\n" + "A=A+1\n" * index + "M=D\n")
+        else:
+            self.write(
+                "@" + str(index) + "\nD=A\n@" + SEGMENT_DICT[segment] +
+                "\nD=M+D\n@R13\nM=D\n" + load + "@R13\nA=M\nM=D\n")
 
     @staticmethod
     def handle_pointer_and_temp(index, segment):
@@ -191,7 +659,198 @@ class CodeWriter:
         The pointer segment is treated as a pointer to the THIS and THAT segments."""
         if segment == "temp":
             return index + 1, "that"  
-        return 0, "that" if index == 1 else (index, "this")
+        return (0, "that") if index == 1 else (index, "this")
+
+    def direct_address(self, segment: str, index: int) -> typing.Optional[str]:
+        """
+        Args:
+            segment (str): a memory segment that is not constant.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: the symbol or address of segment[index] if it is known at
+            translation time (static, inline, temp and pointer), None
+            otherwise.
+        """
+        if segment == "static":
+            return os.path.splitext(self.current_file)[0] + "." + str(index)
+        if segment == "inline":
+            return INLINE_VARIABLE + str(index)
+        if segment == "temp":
+            return str(5 + index)
+        if segment == "pointer":
+            return "THAT" if index == 1 else "THIS"
+        return None
+
+    def load_value(self, segment: str, index: int) -> str:
+        """
+        Args:
+            segment (str): the memory segment to read.
+            index (int): the index in the memory segment.
+
+        Returns:
+            str: assembly code that sets D to segment[index].
+        """
+        key = (segment, index, self.current_file)
+        code = self.load_cache.get(key)
+        if code is None:
+            code = self.load_cache[key] = self.translate_load(segment, index)
+        return code
+
+    def translate_load(self, segment: str, index: int) -> str:
+        """Expands load_value, see there."""
+        if segment == "constant":
+            return "@" + str(index) + "\nD=A\n"
+        address = self.direct_address(segment, index)
+        if address is not None:
+            return "@" + address + "\nD=M\n"
+        if index == 0:
+            return "@" + SEGMENT_DICT[segment] + "\nA=M\nD=M\n"
+        return "@" + str(index) + "\nD=A\n@" + SEGMENT_DICT[segment] + \
+               "\nA=M+D\nD=M\n"
+
+    def write_move(self, source_segment: str, source_index: str,
+                   target_segment: str, target_index: str) -> None:
+        """Writes "push source_segment source_index" followed by
+        "pop target_segment target_index", as a direct memory to memory move
+        that does not touch the stack.
+
+        Args:
+            source_segment (str): the segment to push from.
+            source_index (str): the index in source_segment.
+            target_segment (str): the segment to pop to.
+            target_index (str): the index in target_segment.
+        """
+        self.flush()
+        load = self.load_value(source_segment, int(source_index))
+        index = int(target_index)
+        address = self.direct_address(target_segment, index)
+        if address is not None:
+            self.write(load + "@" + address + "\nM=D\n")
+        elif index <= 3:  # walking to the target is shorter than saving it
+            self.write(
+                load + "@" + SEGMENT_DICT[target_segment] + "\nA=M\n" +
+                "A=A+1\n" * index + "M=D\n")
+        else:
+            self.write(
+                "@" + str(index) + "\nD=A\n@" + SEGMENT_DICT[target_segment] +
+                "\nD=M+D\n@R13\nM=D\n" + load + "@R13\nA=M\nM=D\n")
+
+    def write_if_not(self, label: str) -> None:
+        """Writes "not" followed by "if-goto label". The negation of the
+        popped value is non-zero unless the value is -1 (true), so the jump
+        is taken whenever value + 1 is non-zero.
+
+        Args:
+            label (str): the label to go to if the popped value is not true.
+        """
+        if not self.top_in_d:
+            self.flush()
+            self.write(POP_TO_D)
+        self.top_in_d = False
+        self.write("@" + self.current_function + "$" + label + "\nD+1;JNE\n")
+        if self.profile_instructions:
+            self.open_segment()
+
+    def write_load_that(self) -> None:
+        """Writes "pop pointer 1" followed by "push that 0", which replaces
+        the top of the stack by the value it points to."""
+        if self.top_in_d:
+            self.write("@THAT\nM=D\nA=D\nD=M\n")
+            return
+        self.flush()
+        self.write("@SP\nA=M-1\nD=M\n@THAT\nM=D\nA=D\nD=M\n"
+                   "@SP\nA=M-1\nM=D\n")
+
+    def write_store_that(self) -> None:
+        """Writes "pop temp 0", "pop pointer 1", "push temp 0" and
+        "pop that 0", which pop a value and then an address, and store the
+        value at the address (an array assignment)."""
+        self.flush()
+        self.write("@SP\nAM=M-1\nD=M\n@5\nM=D\n"
+                   "@SP\nAM=M-1\nD=M\n@THAT\nM=D\n"
+                   "@5\nD=M\n@THAT\nA=M\nM=D\n")
+
+    def point_to_top(self) -> str:
+        """
+        Returns:
+            str: assembly code that sets A to the address of the top of the
+            stack in memory.
+        """
+        if self.static_depth:
+            return self.point_to_slot(self.offset - 1)
+        return POINT_TO_Y
+
+    def write_multiply_constant(self, constant: str) -> None:
+        """Writes "push constant constant" followed by
+        "call Math.multiply 2", which replaces the top of the stack by its
+        product with constant: the top is shifted left once for every digit of
+        constant after the first (see signed_digits), and the value is added
+        or subtracted at non-zero digits.
+
+        Args:
+            constant (str): the constant, from 0 to 32767.
+        """
+        digits = signed_digits(int(constant))
+        chain = "".join("D=D<<\n" + ("D=D+M\n" if digit == 1 else
+                                      "D=D-M\n" if digit == -1 else "")
+                        for digit in digits[1:])
+        if self.cache_top:
+            if not self.top_in_d:
+                self.write(POP_TO_D)
+                self.top_in_d = True
+            if not digits:
+                self.write("D=0\n")
+            elif any(digits[1:]):  # keeps the value in R13 for the additions
+                self.write("@R13\nM=D\n" + chain)
+            else:
+                self.write(chain)
+            return
+        if not digits:
+            self.write(self.point_to_top() + "M=0\n")
+        elif any(digits[1:]):
+            self.write(self.point_to_top() + "D=M\n" + chain + "M=D\n")
+        elif len(digits) > 1:  # a power of two is shifted in place
+            self.write(self.point_to_top() + "M=M<<\n" * (len(digits) - 1))
+
+    def write_divide_constant(self, constant: str) -> None:
+        """Writes "push constant constant" followed by "call Math.divide 2"
+        for a power of two constant, which replaces the top of the stack by
+        the same quotient as Math.divide of the OS: the absolute value of the
+        top is shifted right, and its sign is given back. A shift rounds
+        down, so a negative quotient is first added constant - 1.
+
+        Math.divide halves a dividend above 16383 in absolute value and
+        doubles the quotient, which loses the bit of the dividend worth
+        constant, so this bit is cleared first. Math.divide(-32768, constant)
+        is 0, since Math.abs(-32768) is negative.
+
+        Args:
+            constant (str): a power of two, from 1 to 16384.
+        """
+        shift = int(constant).bit_length() - 1
+        label = self.current_function + "$divide." + str(self.counter)
+        self.counter += 1
+        round_up = "@" + str(int(constant) - 1) + "\nD=D+A\n" if shift else ""
+        quotient = (
+            "@R13\nM=D\n@" + label + ".absolute\nD;JGE\nD=-D\n"
+            "@" + label + ".absolute\nD;JGE\n@R13\nM=0\nD=0\n"  # -32768
+            "(" + label + ".absolute)\n@R14\nM=D\n@16384\nD=D&A\n"
+            "@" + label + ".sign\nD;JEQ\n"
+            "@" + constant + "\nD=!A\n@R14\nM=D&M\n"
+            "(" + label + ".sign)\n@R13\nD=M\n@" + label + ".positive\n"
+            "D;JGE\n@R14\nD=-M\n" + round_up +
+            "@" + label + ".shift\n0;JMP\n"
+            "(" + label + ".positive)\n@R14\nD=M\n"
+            "(" + label + ".shift)\n" + "D=D>>\n" * shift)
+        if self.cache_top:
+            if not self.top_in_d:
+                self.write(POP_TO_D)
+                self.top_in_d = True
+            self.write(quotient)
+            return
+        self.write(self.point_to_top() + "D=M\n" + quotient +
+                   self.point_to_top() + "M=D\n")
 
     def write_label(self, label: str) -> None:
         """Writes assembly code that affects the label command. 
@@ -204,7 +863,10 @@ class CodeWriter:
         Args:
             label (str): the label to write.
         """
-        self.output_stream.write("("+self.current_function+"$"+label+")\n")
+        self.flush()
+        self.write("("+self.current_function+"$"+label+")\n")
+        if self.profile_instructions:
+            self.open_segment()
         return
 
     def write_goto(self, label: str) -> None:
@@ -213,7 +875,10 @@ class CodeWriter:
         Args:
             label (str): the label to go to.
         """
-        self.output_stream.write("@"+self.current_function+"$"+label+"\n"+"0;JMP\n")
+        self.flush()
+        self.write("@"+self.current_function+"$"+label+"\n"+"0;JMP\n")
+        if self.profile_instructions:
+            self.open_segment()
 
     def write_if(self, label: str) -> None:
         """Writes assembly code that affects the if-goto command. 
@@ -221,7 +886,18 @@ class CodeWriter:
         Args:
             label (str): the label to go to.
         """
-        self.output_stream.write("@SP\nM=M-1\nA=M\nD=M\n@"+self.current_function+"$"+label+"\nD;JNE\n")
+        if self.top_in_d:
+            self.write("@"+self.current_function+"$"+label+"\nD;JNE\n")
+            self.top_in_d = False
+        elif self.offset:
+            self.write(self.point_to_slot(self.offset - 1) + "D=M\n" +
+                       self.update_sp(self.offset - 1) + "@" +
+                       self.current_function + "$" + label + "\nD;JNE\n")
+            self.offset = 0
+        else:
+            self.write("@SP\nM=M-1\nA=M\nD=M\n@"+self.current_function+"$"+label+"\nD;JNE\n")
+        if self.profile_instructions:
+            self.open_segment()
 
     def write_function(self, function_name: str, n_vars: int) -> None:
         """Writes assembly code that affects the function command. 
@@ -235,13 +911,19 @@ class CodeWriter:
             function_name (str): the name of the function.
             n_vars (int): the number of local variables of the function.
         """
+        self.flush()
+        self.close_segment()
         self.current_function = function_name
         # (function_name)       // injects a function entry label into the code
-        self.output_stream.write("("+function_name+")\n")
+        self.write("("+function_name+")\n")
+        if self.profile is not None and function_name in self.profile:
+            self.write(count_code(
+                PROFILE_BASE + PROFILE_WORDS * self.profile[function_name], 1,
+                function_name + "$profile"))
+            self.open_segment()
         # repeat n_vars times:  // n_vars = number of local variables
         #   push constant 0     // initializes the local variables to 0
-        for i in range(n_vars):
-            self.output_stream.write(SET_LOCAL_TO_ZERO)
+        self.write(SET_LOCAL_TO_ZERO * n_vars)
 
     def write_call(self, function_name: str, n_args: int) -> None:
         """Writes assembly code that affects the call command. 
@@ -259,46 +941,61 @@ class CodeWriter:
             function_name (str): the name of the function to call.
             n_args (int): the number of arguments of the function.
         """
-        label = function_name +"$ret." + str(self.current_return)
-
-        to_write = ["@"+label + "\n", 
-                    "D=A\n@SP\nM=M+1\nA=M-1\nM=D\n",  # push LCL   // saves LCL of the caller
-                    "@R1\n" + SET_NEW,                # push ARG   // saves ARG of the caller
-                    "@R2\n" + SET_NEW,                # push THIS  // saves THIS of the caller
-                    "@R3\n" + SET_NEW,                # push THAT  // saves THAT of the caller
-                    "@R4\n" + SET_NEW,                # ARG = SP-5-n_args  // repositions ARG
-                    "@SP\nD=M\n@"+str(5+n_args)+"\nD=D-A\n@R2\nM=D\n",      # repositions LCL
-                    "@SP\nD=M\n@R1\nM=D\n",                 # transfers control to the callee
-                    "@"+function_name+"\n0;JMP\n", "("+label+")\n" # injects the return address label
-                    ]
-        for code in to_write:
-            self.output_stream.write(code)
+        self.flush()
+        label = self.current_function + "$ret." + str(self.current_return)
+
+        template = SHARED_CALL_TEMPLATE if self.shared_calls else CALL_TEMPLATE
+        self.write(template.format(label, 5 + n_args, function_name))
         self.current_return += 1
+        if self.profile_instructions:
+            self.open_segment()
 
     def write_return(self) -> None:
         """Writes assembly code that affects the return command."""
-        # frame = LCL                  // frame is a temporary variable stored in [R10]
-        self.output_stream.write("@R1\nD=M\n" + "@frame" + str(self.current_return) + "\nM=D\n")
-        # return_address = *(frame-5)   // puts the return address in a temp var [R11]
-        self.output_stream.write("@5\nD=D-A\nA=D\nD=M\n" + "@ret" + str(self.current_return) + "\nM=D\n") # D=M meaningless
-        # *ARG = pop()                  // repositions the return value for the caller
-        self.write_push_pop("pop","argument", 0)
-        # SP = ARG + 1                  // repositions SP for the caller
-        self.output_stream.write("@ARG\nD=M+1\n@SP\nM=D\n")
-
-        load_return_frame = "@frame" + str(self.current_return)
-
-        # THAT = *(frame-1)             // restores THAT for the caller
-        self.output_stream.write(load_return_frame + RETURN_OLD + "@THAT\nM=D\n")
-        # THIS = *(frame-2)             // restores THIS for the caller
-        self.output_stream.write(load_return_frame + RETURN_OLD + "@THIS\nM=D\n")
-        # ARG = *(frame-3)              // restores ARG for the caller
-        self.output_stream.write(load_return_frame + RETURN_OLD + "@ARG\nM=D\n")
-        # LCL = *(frame-4)              // restores LCL for the caller
-        self.output_stream.write(load_return_frame + RETURN_OLD + "@LCL\nM=D\n")
-        # goto return_address           // go to the return address
-        self.output_stream.write("@ret" + str(self.current_return) + "\nA=M\n0;JMP\n")
-        self.current_return += 1
+        self.flush()
+        if self.shared_calls:
+            self.write("@" + RETURN_LABEL + "\n0;JMP\n")
+        else:
+            self.write(RETURN_SAVE_FRAME)
+            # *ARG = pop()                  // repositions the return value for the caller
+            self.write_push_pop("pop","argument", 0)
+            self.write(RETURN_RESTORE)
+            self.offset = 0  # SP is set by RETURN_RESTORE
+        if self.profile_instructions:
+            self.open_segment()
+
+    def write_tail_call(self, function_name: str, n_args: str) -> None:
+        """Writes "call function_name n_args" followed by "return", which
+        jumps to the function in the frame of the current function (see
+        TAIL_CALL_SAVE_FRAME), so the stack does not grow.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (str): the number of arguments of the function.
+        """
+        self.flush()
+        self.write(TAIL_CALL_SAVE_FRAME)
+        if int(n_args):
+            self.write("@SP\nD=M\n@" + n_args + "\nD=D-A\n@R13\nM=D\n" +
+                       "@ARG\nD=M\n@R14\nM=D\n" +
+                       TAIL_CALL_MOVE_ARGUMENT * int(n_args))
+        else:
+            self.write("@ARG\nD=M\n@R14\nM=D\n")
+        self.write(TAIL_CALL_RESTORE_FRAME + "@" + function_name + "\n0;JMP\n")
+        if self.profile_instructions:
+            self.open_segment()
+
+    def write_shared_routines(self) -> None:
+        """Writes the shared call, return and comparison routines that are
+        used by the translation. Should be called once, where the routines are never reached by
+        falling through (e.g. right after the call to Sys.init).
+        """
+        if self.shared_calls:
+            self.write(CALL_ROUTINE + RETURN_ROUTINE)
+        if self.shared_comparisons:
+            for command in ("eq", "gt", "lt"):
+                self.write(COMPARISON_ROUTINE % (
+                    command, rename_labels(ART_DICT[command], "$" + command + "$")))
 
 
 
@@ -0,0 +1,193 @@
+"""
+Inlining of small functions at their call sites.
+
+A call is inlined if the function is a leaf (it calls no other function, so it is
+not recursive and its inlined body runs from start to end without
+interruption), its body has at most threshold commands, and the plain
+translation of the inlined call is estimated to take fewer cycles than the
+call and return. The call is then replaced by:
+
+- pops of the arguments into the "inline" segment, a segment of global
+  variables (see CodeWriter), followed by the locals, initialized to 0,
+- when the function changes THIS or THAT, saving them in the inline segment,
+- the body, with argument and local remapped to the inline segment, labels
+  renamed to be unique at every call site, static segments that keep
+  naming the file of the function, and every return but the last one
+  replaced by a jump to the end of the body,
+- restoring THIS and THAT, if they were saved.
+
+The return value is left on the stack, in place of the arguments, just like
+after a call. Since inlined bodies never call functions, all call sites can
+share the same inline variables.
+"""
+import io
+import os
+import typing
+from CallGraph import split_functions
+from CodeWriter import CodeWriter
+from Parser import Parser
+
+DEFAULT_THRESHOLD = 12  # commands in the body of an inlined function
+
+Command = list[str]
+
+
+def count_instructions(commands: list[Command], function_name: str = "",
+                       n_args: int = 0, n_vars: int = 0) -> int:
+    """Estimates cycles by the length of a plain translation.
+
+    Args:
+        commands (list[Command]): push and pop commands to translate.
+        function_name (str): if given, also translates a call to this
+            function and its entry and return.
+        n_args (int): the number of arguments of the call.
+        n_vars (int): the number of locals of the function.
+
+    Returns:
+        int: the number of instructions in the translation.
+    """
+    output = io.StringIO()
+    code_writer = CodeWriter(output)
+    for command in commands:
+        code_writer.write_push_pop(command[0], command[1], int(command[2]))
+    if function_name:
+        code_writer.write_call(function_name, n_args)
+        code_writer.write_function(function_name, n_vars)
+        code_writer.write_return()
+    code_writer.close()
+    return sum(1 for line in output.getvalue().splitlines()
+               if line and line[0] != "(")
+
+
+class Inliner:
+    """Replaces calls to small leaf functions by their bodies, and counts
+    the inlined call sites."""
+
+    def __init__(self, input_paths: list[str],
+                 threshold: int = DEFAULT_THRESHOLD) -> None:
+        """Finds the functions of a program that can be inlined.
+
+        Args:
+            input_paths (list[str]): the .vm files of the program.
+            threshold (int): the maximal number of commands in the body of
+                an inlined function.
+        """
+        self.functions = {}  # name -> (file, n_vars, body)
+        for input_path in input_paths:
+            with open(input_path, 'r') as input_file:
+                commands = Parser(input_file).commands[:-1]
+            for name, body in split_functions(commands).items():
+                if name and self.can_inline(body[1:], threshold):
+                    self.functions[name] = (os.path.basename(input_path),
+                                            int(body[0][2]), body[1:])
+        self.sites = {}  # inlined call sites of every function
+        self.cycles_saved = {}  # estimated cycles saved per call
+        self.site_counter = 0
+
+    @staticmethod
+    def can_inline(body: list[Command], threshold: int) -> bool:
+        """
+        Args:
+            body (list[Command]): the commands of a function, after its
+                "function" command.
+            threshold (int): the maximal number of commands in the body.
+
+        Returns:
+            bool: can calls to the function be replaced by its body?
+        """
+        return bool(body) and body[-1] == ["return"] and \
+            len(body) - 1 <= threshold and \
+            all(command[0] != "call" for command in body)
+
+    def inline_call(self, name: str,
+                    n_args: int) -> typing.Optional[list[Command]]:
+        """
+        Args:
+            name (str): the called function.
+            n_args (int): the number of arguments of the call.
+
+        Returns:
+            list[Command]: the commands that replace the call, or None if the
+            call can't be inlined.
+        """
+        file, n_vars, body = self.functions[name]
+        if any(command[0] in ("push", "pop") and command[1] == "argument" and
+               int(command[2]) >= n_args for command in body):
+            return None
+        saved = n_args + n_vars  # where THIS and THAT are saved
+        writes_pointer = ["pop", "pointer", "0"] in body or \
+            ["pop", "pointer", "1"] in body
+
+        prologue = [["pop", "inline", str(i)] for i in reversed(range(n_args))]
+        for i in range(n_vars):
+            prologue += [["push", "constant", "0"],
+                         ["pop", "inline", str(n_args + i)]]
+        epilogue = []
+        if writes_pointer:
+            prologue += [["push", "pointer", "0"], ["pop", "inline", str(saved)],
+                         ["push", "pointer", "1"],
+                         ["pop", "inline", str(saved + 1)]]
+            epilogue += [["push", "inline", str(saved)], ["pop", "pointer", "0"],
+                         ["push", "inline", str(saved + 1)],
+                         ["pop", "pointer", "1"]]
+        cycles_saved = count_instructions([], name, n_args, n_vars) - \
+            count_instructions(prologue + epilogue)
+        if cycles_saved <= 0:  # moving the arguments costs more than the call
+            return None
+
+        prefix = name + "$inline." + str(self.site_counter) + "."
+        self.site_counter += 1
+        commands = list(prologue)
+        for command in body[:-1]:
+            if command == ["return"]:
+                commands.append(["goto", prefix + "end"])
+            elif command[0] in ("label", "goto", "if-goto"):
+                commands.append([command[0], prefix + command[1]])
+            elif command[0] in ("push", "pop") and command[1] == "argument":
+                commands.append([command[0], "inline", command[2]])
+            elif command[0] in ("push", "pop") and command[1] == "local":
+                commands.append([command[0], "inline",
+                                 str(n_args + int(command[2]))])
+            elif command[0] in ("push", "pop") and command[1] == "static":
+                commands.append(command + [file])
+            else:
+                commands.append(command)
+        if ["return"] in body[:-1]:
+            commands.append(["label", prefix + "end"])
+        commands += epilogue
+
+        self.sites[name] = self.sites.get(name, 0) + 1
+        self.cycles_saved[name] = cycles_saved
+        return commands
+
+    def inline(self, parser: Parser) -> None:
+        """Inlines the calls in the commands of a parser that did not advance
+        yet.
+
+        Args:
+            parser (Parser): the parser of a file.
+        """
+        # inlined labels are also prefixed by the calling function (see
+        # CodeWriter.write_label), so counting sites per file keeps them
+        # unique and makes the translation of a file independent of others
+        self.site_counter = 0
+        commands = []
+        for command in parser.commands[:-1]:
+            if command[0] == "call" and command[1] in self.functions:
+                inlined = self.inline_call(command[1], int(command[2]))
+                if inlined is not None:
+                    commands.extend(inlined)
+                    continue
+            commands.append(command)
+        parser.commands = commands + [parser.commands[-1]]  # keeps the end marker
+        parser.current_command = parser.commands[parser.counter]
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: the inlined call sites of every function, and the estimated
+            cycles saved by each call.
+        """
+        return "".join(f"  {name}: {sites} call sites, about "
+                       f"{self.cycles_saved[name]} cycles saved per call\n"
+                       for name, sites in sorted(self.sites.items()))
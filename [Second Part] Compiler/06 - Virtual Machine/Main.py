@@ -6,49 +6,330 @@ as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 
+import argparse
+import concurrent.futures
+import contextlib
+import copy
+import io
+import itertools
 import os
 import sys
 import typing
-from Parser import Parser
-from CodeWriter import CodeWriter
+from Parser import Parser, compile_command, read_commands, stream_commands
+from CodeWriter import CodeWriter, PROFILE_BASE, PROFILE_WORDS
+from CallGraph import call_graph, keep_functions, reachable_functions
+from Inliner import DEFAULT_THRESHOLD, Inliner
+from Peephole import Peephole
+from Profiler import profile_slots
+from TranslationCache import TranslationCache
+from Verifier import verify_file
 
 SP_DEFAULT = 256
 
 SET_SP = "@"+ str(SP_DEFAULT) +"\nD=A\n@SP\nM=D\n"
 
+CACHE_DIRECTORY = ".vmcache"
+
+# commands whose second word is a label or a function name, which does not
+# change the length of their plain translation (see count_plain_instructions)
+NAMED_COMMANDS = {"label", "goto", "if-goto", "function", "call"}
+
+
 def translate_file(
-        input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
+        input_file: typing.TextIO, code_writer: CodeWriter,
+        bootstrap: bool, peephole: typing.Optional[Peephole] = None,
+        functions: typing.Optional[typing.Container[str]] = None,
+        inliner: typing.Optional[Inliner] = None) -> None:
     """Translates a single file.
 
+    Without peephole, functions and inliner the file is streamed: every
+    command is translated as soon as it is read, in constant memory, so the
+    file may also be a pipe. Otherwise, the file is parsed as a whole, since
+    these passes rewrite whole files.
+
     Args:
         input_file (typing.TextIO): the file to translate.
-        output_file (typing.TextIO): writes all output to this file.
+        code_writer (CodeWriter): writes all output.
         bootstrap (bool): if this is True, the current file is the 
             first file we are translating.
+        peephole (Peephole): if given, optimizes the commands before they
+            are translated.
+        functions (typing.Container[str]): if given, only these functions
+            are translated.
+        inliner (Inliner): if given, inlines calls to small functions.
     """
-    parser = Parser(input_file) 
-    code_writer = CodeWriter(output_file)
+    if peephole is None and functions is None and inliner is None:
+        commands = stream_commands(input_file)
+    else:
+        parser = Parser(input_file) 
+        if functions is not None:
+            keep_functions(parser, functions)
+        if inliner is not None:
+            inliner.inline(parser)
+        if peephole is not None:
+            peephole.optimize(parser)
+        commands = zip(*parser.compile())
+
+    if bootstrap: 
+        write_bootstrap(code_writer)
 
     input_filename, input_extension = os.path.splitext(os.path.basename(input_file.name))
     code_writer.set_file_name(input_filename+input_extension)
-
-    if bootstrap: 
-        code_writer.output_stream.write(SET_SP)
-        code_writer.write_call("Sys.init", 0)
     
-    while parser.has_more_commands():
-        method, i = code_writer.get_method_and_index(parser.command_type())
-        if not i:
-            method() 
-        elif i == 1:
-            method(parser.arg1())
-        elif i == 2:
-            method(parser.arg1(), parser.arg2())
-        else:
-            method(parser.current_command[0], parser.arg1(), parser.arg2())
-        parser.advance()
-    code_writer.set_file_name = None
+    code_writer.write_commands(commands)
+
+
+def write_bootstrap(code_writer: CodeWriter) -> None:
+    """Writes the bootstrap code, which sets SP and calls Sys.init, followed
+    by the shared routines of the translation. In a profiled translation the
+    stack starts after the profile counters.
+
+    Args:
+        code_writer (CodeWriter): writes the code.
+    """
+    if code_writer.profile is None:
+        code_writer.write(SET_SP)
+    else:
+        stack_base = PROFILE_BASE + PROFILE_WORDS * len(code_writer.profile)
+        code_writer.write("@" + str(stack_base) + "\nD=A\n@SP\nM=D\n")
+    code_writer.write_call("Sys.init", 0)
+    code_writer.write_shared_routines()
+
+
+def translate_path(input_path: str, output_file: typing.TextIO,
+                   peephole: typing.Optional[Peephole] = None,
+                   functions: typing.Optional[typing.Container[str]] = None,
+                   inliner: typing.Optional[Inliner] = None,
+                   **options: bool) -> None:
+    """Translates a single file on its own, with its own CodeWriter.
+
+    Args:
+        input_path (str): the .vm file.
+        output_file (typing.TextIO): writes the assembly code of the file.
+        peephole (Peephole): if given, optimizes the commands of the file.
+        functions (typing.Container[str]): if given, only these functions
+            are translated.
+        inliner (Inliner): if given, inlines calls to small functions.
+        **options (bool): translation options, see CodeWriter.
+    """
+    code_writer = CodeWriter(output_file, **options)
+    with open(input_path, 'r') as input_file:
+        translate_file(input_file, code_writer, False, peephole, functions,
+                       inliner)
+    code_writer.close()
+
+
+def translate_fragment(input_path: str,
+                       peephole: typing.Optional[Peephole] = None,
+                       functions: typing.Optional[typing.Container[str]] = None,
+                       inliner: typing.Optional[Inliner] = None,
+                       **options: bool) -> str:
+    """Translates a single file on its own, see translate_path.
+
+    Returns:
+        str: the assembly code of the file.
+    """
+    output = io.StringIO()
+    translate_path(input_path, output, peephole, functions, inliner,
+                   **options)
+    return output.getvalue()
+
+
+def translate_in_worker(
+        input_path: str, peephole: typing.Optional[Peephole],
+        functions: typing.Optional[typing.Container[str]],
+        inliner: typing.Optional[Inliner], options: dict[str, bool]) -> tuple:
+    """Translates a single file in a worker process. The peephole optimizer
+    and the inliner are copies of those of the main process, so their counts
+    are started from zero and returned, to be added to the originals.
+
+    Returns:
+        tuple: the assembly code of the file, the hits of every peephole
+        rule, and the inlined call sites and the cycles saved by every
+        inlined function.
+    """
+    if peephole is not None:
+        peephole.hits = dict.fromkeys(peephole.hits, 0)
+    if inliner is not None:
+        inliner.sites = {}
+    fragment = translate_fragment(input_path, peephole, functions, inliner,
+                                  **options)
+    return (fragment, peephole and peephole.hits,
+            inliner and (inliner.sites, inliner.cycles_saved))
+
+
+def translate_files(input_paths: list[str], output_file: typing.TextIO,
+                    peephole: typing.Optional[Peephole] = None,
+                    functions: typing.Optional[typing.Container[str]] = None,
+                    inliner: typing.Optional[Inliner] = None,
+                    workers: int = 1,
+                    cache: typing.Optional[TranslationCache] = None,
+                    **options: bool) -> None:
+    """Translates the files of a program into a single assembly file.
+
+    Every file is translated into its own fragment, and its labels are
+    scoped by the file (see CodeWriter.set_file_name), so fragments do not
+    depend on each other. The output is the bootstrap code followed by the
+    fragments in the order of input_paths, and it is the same for any number
+    of workers, and whether or not fragments are taken from a cache.
+
+    Args:
+        input_paths (list[str]): the .vm files.
+        output_file (typing.TextIO): writes all output to this file.
+        peephole (Peephole): if given, optimizes the commands of every file.
+        functions (typing.Container[str]): if given, only these functions
+            are translated.
+        inliner (Inliner): if given, inlines calls to small functions.
+        workers (int): the number of processes that translate files in
+            parallel, files are translated by this process if it is 1.
+        cache (TranslationCache): if given, fragments of files that were
+            translated before with the same options are taken from it, and
+            the other fragments are stored in it.
+        **options (bool): translation options, see CodeWriter.
+    """
+    code_writer = CodeWriter(output_file, **options)
+    write_bootstrap(code_writer)
+    code_writer.close()
+    if cache is None and (workers <= 1 or len(input_paths) <= 1):
+        for input_path in input_paths:
+            translate_path(input_path, output_file, peephole, functions,
+                           inliner, **options)
+        return
+    keys = [cache and cache.key(input_path, peephole, functions, inliner,
+                                options) for input_path in input_paths]
+    cached = [cache and cache.load(key) for key in keys]
+    missing = [input_path for input_path, result in zip(input_paths, cached)
+               if result is None]
+    # translate_in_worker starts the counts from zero, so the counts of this
+    # process are kept aside and added up here
+    hits_total = peephole and dict(peephole.hits)
+    sites_total = inliner and dict(inliner.sites)
+    parallel = workers > 1 and len(missing) > 1
+    with concurrent.futures.ProcessPoolExecutor(workers) if parallel \
+            else contextlib.nullcontext() as executor:
+        translated = (executor.map if parallel else map)(
+            translate_in_worker, missing, itertools.repeat(peephole),
+            itertools.repeat(functions), itertools.repeat(inliner),
+            itertools.repeat(options))
+        for key, result in zip(keys, cached):  # in the order of input_paths
+            if result is None:
+                result = next(translated)
+                if cache is not None:
+                    cache.store(key, result)
+            fragment, hits, inlined = result
+            output_file.write(fragment)
+            if peephole is not None:
+                for name, count in hits.items():
+                    hits_total[name] += count
+            if inliner is not None:
+                sites, cycles_saved = inlined
+                for name, count in sites.items():
+                    sites_total[name] = sites_total.get(name, 0) + count
+                inliner.cycles_saved.update(cycles_saved)
+    if peephole is not None:
+        peephole.hits = hits_total
+    if inliner is not None:
+        inliner.sites = sites_total
+
+
+class InstructionCounter:
+    """Writes assembly code to a stream and counts its ROM instructions on
+    the way, so that they are counted without keeping the code."""
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        """
+        Args:
+            output_stream (typing.TextIO): the stream the code is written to.
+        """
+        self.output_stream = output_stream
+        self.instructions = 0
+
+    def write(self, assembly: str) -> None:
+        """Writes and counts assembly code made of whole lines."""
+        self.instructions += count_instructions(assembly)
+        self.output_stream.write(assembly)
+
+
+def count_plain_instructions(input_paths: list[str]) -> int:
+    """Counts the ROM instructions of the plain translation of a program,
+    without translating it. The plain translation of a command does not
+    depend on the commands around it, and its length does not depend on the
+    names of labels and functions, so only the first command of every kind
+    is translated and counted.
+
+    Args:
+        input_paths (list[str]): the .vm files of the program.
+
+    Returns:
+        int: the ROM instructions of the plain translation, with the
+        bootstrap code.
+    """
+    def count_code(write: typing.Callable[[CodeWriter], None]) -> int:
+        output = io.StringIO()
+        code_writer = CodeWriter(output)
+        write(code_writer)
+        code_writer.close()
+        return count_instructions(output.getvalue())
+
+    instructions = count_code(write_bootstrap)
+    lengths = {}
+    for input_path in input_paths:
+        with open(input_path, 'r') as input_file:
+            for words in read_commands(input_file):
+                key = (words[0], *words[2:]) if words[0] in NAMED_COMMANDS \
+                    else tuple(words)
+                if key not in lengths:
+                    lengths[key] = count_code(
+                        lambda code_writer: code_writer.write_commands(
+                            [compile_command(words)]))
+                instructions += lengths[key]
+    return instructions
+
+
+def count_function_instructions(
+        input_paths: list[str], functions: typing.Container[str],
+        peephole: typing.Optional[Peephole] = None,
+        inliner: typing.Optional[Inliner] = None, **options: bool) -> int:
+    """Counts the ROM instructions of some of the functions of a program,
+    translated on their own with the given passes and options. Copies of the
+    peephole optimizer and the inliner are used, so their reports do not
+    count these functions.
+
+    Args:
+        input_paths (list[str]): the .vm files of the program.
+        functions (typing.Container[str]): the functions to count.
+        peephole (Peephole): if given, optimizes the commands of every file.
+        inliner (Inliner): if given, inlines calls to small functions.
+        **options (bool): translation options, see CodeWriter.
+
+    Returns:
+        int: the ROM instructions of the functions.
+    """
+    if peephole is not None:
+        peephole = copy.copy(peephole)
+        peephole.hits = dict.fromkeys(peephole.hits, 0)
+    if inliner is not None:
+        inliner = copy.copy(inliner)
+        inliner.sites = {}
+    with open(os.devnull, 'w') as null_file:
+        counter = InstructionCounter(null_file)
+        for input_path in input_paths:
+            translate_path(input_path, counter, peephole, functions, inliner,
+                           **options)
+    return counter.instructions
+
+
+def count_instructions(assembly: str) -> int:
+    """
+    Args:
+        assembly (str): assembly code written by the translator, made of
+            whole lines without blank lines or comments.
+
+    Returns:
+        int: the number of ROM instructions it assembles into.
+    """
+    # every line is an instruction or a label, and only labels have "("
+    return assembly.count("\n") - assembly.count("(")
 
 
 if "__main__" == __name__:
@@ -57,25 +338,138 @@ if "__main__" == __name__:
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    argument_parser = argparse.ArgumentParser(prog="VMtranslator")
+    argument_parser.add_argument("path", help="a .vm file or a directory")
+    argument_parser.add_argument(
+        "--shared-calls", action="store_true",
+        help="jump to shared call and return routines instead of inlining "
+             "them")
+    argument_parser.add_argument(
+        "--shared-comparisons", action="store_true",
+        help="jump to shared eq, gt and lt routines instead of inlining them")
+    stack_mode = argument_parser.add_mutually_exclusive_group()
+    stack_mode.add_argument(
+        "--cache-top", action="store_true",
+        help="keep the top of the stack in D within basic blocks")
+    stack_mode.add_argument(
+        "--static-depth", action="store_true",
+        help="address stack slots relative to SP within basic blocks, and "
+             "update SP once per block")
+    argument_parser.add_argument(
+        "--peephole", action="store_true",
+        help="fuse common command sequences, and report the hits of every "
+             "rule")
+    argument_parser.add_argument(
+        "--eliminate-dead", action="store_true",
+        help="translate only the functions that can be reached from "
+             "Sys.init, and report the dropped functions")
+    argument_parser.add_argument(
+        "--inline", type=int, nargs="?", const=DEFAULT_THRESHOLD,
+        metavar="N", help="inline calls to leaf functions of at most N "
+                          f"commands (default: {DEFAULT_THRESHOLD})")
+    argument_parser.add_argument(
+        "--profile", action="store_true",
+        help="count the calls to every function in RAM, see Profiler.py")
+    argument_parser.add_argument(
+        "--profile-instructions", action="store_true",
+        help="with --profile, also count the instructions run by every "
+             "function")
+    argument_parser.add_argument(
+        "--verify", action="store_true",
+        help="instead of translating, check that the basic blocks of the "
+             "input are translated equivalently with and without the "
+             "options")
+    argument_parser.add_argument(
+        "--workers", type=int, default=1, metavar="N",
+        help="translate the files in N parallel processes, the output does "
+             "not depend on N (default: 1)")
+    argument_parser.add_argument(
+        "--cache", nargs="?", const="", metavar="DIR",
+        help="reuse the translations of files that did not change since "
+             f"they were translated with the same options, kept in DIR "
+             f"(default: {CACHE_DIRECTORY} next to the output)")
+    arguments = argument_parser.parse_args()
+    # options given to CodeWriter, the ROM instruction count is reported
+    # when any is used
+    options = {"shared_calls": arguments.shared_calls,
+               "shared_comparisons": arguments.shared_comparisons,
+               "cache_top": arguments.cache_top,
+               "static_depth": arguments.static_depth}
+    argument_path = os.path.abspath(arguments.path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
         output_path = os.path.join(argument_path, os.path.basename(
             argument_path))
     else:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
     output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
+    files_to_translate = [
+        input_path for input_path in files_to_translate
+        if os.path.splitext(input_path)[1].lower() == ".vm"]
+
+    if arguments.verify:
+        checked = 0
+        failures = []
         for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
             with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
+                file_checked, file_failures = verify_file(
+                    input_file, Peephole() if arguments.peephole else None,
+                    **options)
+            checked += file_checked
+            failures += file_failures
+        for failure in failures:
+            print(f"Not equivalent: {failure}", file=sys.stderr)
+        print(f"Verified {checked - len(failures)}/{checked} basic blocks")
+        sys.exit(1 if failures else 0)
+
+    if arguments.profile_instructions and not arguments.profile:
+        sys.exit("--profile-instructions requires --profile")
+    if arguments.profile:
+        options["profile"] = profile_slots(files_to_translate)
+        options["profile_instructions"] = arguments.profile_instructions
+    cache = None
+    if arguments.cache is not None:
+        cache = TranslationCache(arguments.cache or os.path.join(
+            os.path.dirname(output_path), CACHE_DIRECTORY))
+    peephole = Peephole() if arguments.peephole else None
+    functions = None
+    if arguments.eliminate_dead:
+        graph = call_graph(files_to_translate)
+        try:
+            functions = reachable_functions(graph)
+        except ValueError as error:
+            sys.exit(f"Cannot eliminate dead functions: {error}")
+    inliner = None
+    if arguments.inline is not None:
+        inliner = Inliner(files_to_translate, arguments.inline)
+    optimized = any(options.values()) or peephole is not None or \
+        functions is not None or inliner is not None
+    with open(output_path, 'w') as output_file:
+        output = InstructionCounter(output_file) if optimized else output_file
+        translate_files(files_to_translate, output, peephole, functions,
+                        inliner, arguments.workers, cache, **options)
+    if optimized:
+        before = count_plain_instructions(files_to_translate)
+        after = output.instructions
+        print(f"ROM instructions: {before} before, {after} after "
+              f"({before - after} saved, {1 - after / before:.1%})")
+    if functions is not None:
+        dropped = sorted(set(graph) - functions)
+        saved = count_function_instructions(
+            files_to_translate, set(dropped), peephole, inliner, **options)
+        print(f"Dropped {len(dropped)} unreachable functions, saving "
+              f"{saved} ROM words:")
+        for name in dropped:
+            print(f"  {name}")
+    if inliner is not None:
+        print(f"Inlined {sum(inliner.sites.values())} call sites:")
+        sys.stdout.write(inliner.report())
+    if peephole is not None:
+        print("Peephole rule hits:")
+        sys.stdout.write(peephole.report())
+    if cache is not None:
+        print(f"Reused {cache.hits}/{cache.hits + cache.misses} cached "
+              f"translations")
@@ -5,8 +5,95 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import array
+import sys
 import typing
 
+# Fused commands, which are not part of the VM language but are written by
+# the peephole optimizer (see Peephole.py) in place of common sequences.
+FUSED_COMMAND_TYPES = {"move": "C_MOVE",
+                       "if-not-goto": "C_IF_NOT",
+                       "load-that": "C_LOAD_THAT",
+                       "store-that": "C_STORE_THAT",
+                       "multiply-constant": "C_MULTIPLY_CONSTANT",
+                       "divide-constant": "C_DIVIDE_CONSTANT",
+                       "tail-call": "C_TAIL_CALL"
+                       }
+
+# The type of every command by its first word, all other one word commands
+# are arithmetic commands.
+COMMAND_TYPES = {"push": "C_PUSH",
+                 "pop": "C_POP",
+                 "label": "C_LABEL",
+                 "goto": "C_GOTO",
+                 "if-goto": "C_IF",
+                 "function": "C_FUNCTION",
+                 "call": "C_CALL",
+                 "return": "C_RETURN",
+                 **FUSED_COMMAND_TYPES
+                 }
+
+# The integer opcode of every command type in the compact IR (see compile),
+# which is also its index in the dispatch table of CodeWriter.
+OPCODES = {command_type: opcode for opcode, command_type in enumerate(
+    ("C_ARITHMETIC", *dict.fromkeys(COMMAND_TYPES.values())))}
+
+
+def read_commands(input_file: typing.TextIO) -> typing.Iterator[list[str]]:
+    """Reads the commands of a VM file one line at a time, so the file is
+    never held in memory, and it may be a pipe.
+
+    Args:
+        input_file (typing.TextIO): input file.
+
+    Returns:
+        typing.Iterator[list[str]]: the words of every command, without
+        comments and empty rows.
+    """
+    for line in input_file:
+        line = line.rstrip("\n")
+        if line and line[0] not in " /":
+            yield line.split("//")[0].split()
+
+
+def compile_command(command: list[str]) -> tuple[int, tuple]:
+    """Converts a command to the compact IR: an integer opcode (see OPCODES)
+    and a tuple of operands, which are the arguments of the CodeWriter method
+    that translates it. The indices and counts are parsed to int, and the
+    words are interned, so equal words share a single string.
+
+    Args:
+        command (list[str]): the words of a command.
+
+    Returns:
+        tuple[int, tuple]: the opcode and the operands of the command.
+    """
+    command_type = COMMAND_TYPES.get(command[0], "C_ARITHMETIC")
+    if command_type in ("C_PUSH", "C_POP"):  # a fourth word is a file
+        return OPCODES[command_type], (
+            sys.intern(command[0]), sys.intern(command[1]), int(command[2]),
+            *map(sys.intern, command[3:]))
+    if command_type in ("C_FUNCTION", "C_CALL"):
+        return OPCODES[command_type], (sys.intern(command[1]), int(command[2]))
+    if command_type == "C_ARITHMETIC":
+        return OPCODES[command_type], (sys.intern(command[0]),)
+    return OPCODES[command_type], tuple(map(sys.intern, command[1:]))
+
+
+def stream_commands(
+        input_file: typing.TextIO) -> typing.Iterator[tuple[int, tuple]]:
+    """The streaming mode of the parser: compiles the commands of a VM file
+    one at a time, as they are read, in constant memory.
+
+    Args:
+        input_file (typing.TextIO): input file.
+
+    Returns:
+        typing.Iterator[tuple[int, tuple]]: the opcode and the operands of
+        every command (see compile_command).
+    """
+    return map(compile_command, read_commands(input_file))
+
 
 class Parser:
     """
@@ -52,9 +139,8 @@ class Parser:
         Args:
             input_file (typing.TextIO): input file.
         """
-        self.input_lines = input_file.read().splitlines()  # spliting the file into lines.
         # cleaning the lines from comments and empty rows.
-        self.commands = [x.split("//")[0].split() for x in self.input_lines if x and x[0] not in " /"]
+        self.commands = list(read_commands(input_file))
         self.commands.append(['end'])  # no more commands marker.
         self.counter = 0  # current command index.
         self.current_command = self.commands[self.counter]  # first command.
@@ -82,11 +168,9 @@ class Parser:
             "C_ARITHMETIC" is returned for all arithmetic commands.
             For other commands, can return:
             "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION",
-            "C_RETURN", "C_CALL".
+            "C_RETURN", "C_CALL", or the type of a fused command.
         """
-        if len(self.current_command) == 1:
-            return "C_ARITHMETIC"
-        return "C_IF" if self.current_command[0][:2] == "if" else "C_" + self.current_command[0].upper()
+        return COMMAND_TYPES.get(self.current_command[0], "C_ARITHMETIC")
 
     def arg1(self) -> str:
         """
@@ -105,3 +189,23 @@ class Parser:
             "C_FUNCTION" or "C_CALL".
         """
         return int(self.current_command[2])
+
+    def compile(self) -> tuple[array.array, list[tuple]]:
+        """Converts the remaining commands to the compact IR (see
+        compile_command), and advances past them.
+
+        Returns:
+            tuple[array.array, list[tuple]]: the opcode of every command, as
+            bytes, and the operands of every command.
+        """
+        opcodes = array.array("B")
+        operands = []
+        commands = self.commands[self.counter:-1]
+        commands.reverse()  # popped in order, freeing every compiled command
+        self.commands = self.commands[:self.counter] + [self.commands[-1]]
+        self.current_command = self.commands[self.counter]
+        while commands:
+            opcode, command_operands = compile_command(commands.pop())
+            opcodes.append(opcode)
+            operands.append(command_operands)
+        return opcodes, operands
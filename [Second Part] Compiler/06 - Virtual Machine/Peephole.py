@@ -0,0 +1,164 @@
+"""
+A peephole optimizer over the parsed VM commands.
+
+The optimizer runs between the Parser and the CodeWriter: it scans the
+commands of a file and replaces common sequences written by the Jack compiler
+with fused commands (see FUSED_COMMAND_TYPES in Parser.py), which CodeWriter
+translates without going through the stack.
+
+Each rule of the rule table is a pattern, a sequence of commands where None
+matches any word, and a function that gets the matched commands and returns
+the commands that replace them, or None if they should be kept after all. At
+every position the rules are tried in order, so longer patterns should come
+first. To add a rule, add it to RULES, and if it writes a new fused command,
+add the command to FUSED_COMMAND_TYPES and its method to the dispatch table
+of CodeWriter. Rewrite functions are defined at module level, so that
+optimizers can be sent to the worker processes of a parallel translation.
+
+The multiplication and division rules replace calls to the OS by the
+results of the OS of this repository: Math.multiply returns the product
+modulo 2^16, and Math.divide returns the integer part of the quotient,
+except for large dividends (see CodeWriter.write_divide_constant). A tail
+call, whose function returns right after the call, keeps the stack depth
+constant, so tail recursion runs in constant stack space.
+"""
+import typing
+from Parser import Parser
+
+Command = list[str]
+
+
+def rewrite_array_store(*commands: Command) -> list[Command]:
+    return [["store-that"]]
+
+
+def rewrite_array_load(*commands: Command) -> list[Command]:
+    return [["load-that"]]
+
+
+def rewrite_move(push: Command, pop: Command) -> list[Command]:
+    return [["move", push[1], push[2], pop[1], pop[2]]]
+
+
+def rewrite_not_if_goto(not_command: Command,
+                        if_goto: Command) -> list[Command]:
+    return [["if-not-goto", if_goto[1]]]
+
+
+def rewrite_multiply_constant(push: Command, call: Command) -> list[Command]:
+    return [["multiply-constant", push[2]]]
+
+
+def rewrite_constant_multiply(push_constant: Command, push: Command,
+                              call: Command) -> list[Command]:
+    return [push, ["multiply-constant", push_constant[2]]]
+
+
+def rewrite_divide_constant(
+        push: Command, call: Command) -> typing.Optional[list[Command]]:
+    constant = int(push[2])
+    if constant <= 0 or constant & (constant - 1):
+        return None  # only divisions by powers of two are shifts
+    return [["divide-constant", push[2]]]
+
+
+def rewrite_tail_call(call: Command, return_command: Command) -> list[Command]:
+    return [["tail-call", call[1], call[2]]]
+
+
+RULES = {
+    # pop temp 0, pop pointer 1, push temp 0, pop that 0 -> *address = value
+    "array_store": ((("pop", "temp", "0"), ("pop", "pointer", "1"),
+                     ("push", "temp", "0"), ("pop", "that", "0")),
+                    rewrite_array_store),
+    # pop pointer 1, push that 0 -> replace the top of the stack by *top
+    "array_load": ((("pop", "pointer", "1"), ("push", "that", "0")),
+                   rewrite_array_load),
+    # push constant K, call Math.multiply 2 -> shifts and additions
+    "multiply_constant": ((("push", "constant", None),
+                           ("call", "Math.multiply", "2")),
+                          rewrite_multiply_constant),
+    # push constant K, push X, call Math.multiply 2 -> the same, after push X
+    "constant_multiply": ((("push", "constant", None), ("push", None, None),
+                           ("call", "Math.multiply", "2")),
+                          rewrite_constant_multiply),
+    # push constant 2^k, call Math.divide 2 -> right shifts
+    "divide_constant": ((("push", "constant", None),
+                         ("call", "Math.divide", "2")),
+                        rewrite_divide_constant),
+    # call F N, return -> jump to F in the frame of the current function
+    "tail_call": ((("call", None, None), ("return",)), rewrite_tail_call),
+    # push X, pop Y -> Y = X
+    "move": ((("push", None, None), ("pop", None, None)), rewrite_move),
+    # not, if-goto L -> jump to L if the top of the stack is not -1 (true)
+    "not_if_goto": ((("not",), ("if-goto", None)), rewrite_not_if_goto),
+}
+
+
+class Peephole:
+    """Rewrites sequences of VM commands by a table of rules, and counts how
+    many times each rule was applied."""
+
+    def __init__(self, rules: typing.Optional[dict] = None) -> None:
+        """
+        Args:
+            rules (dict): the rule table, maps the name of every rule to its
+                pattern and its rewrite function. Defaults to RULES.
+        """
+        self.rules = RULES if rules is None else rules
+        self.hits = {name: 0 for name in self.rules}
+
+    @staticmethod
+    def matches(pattern: tuple, commands: list[Command], start: int) -> bool:
+        """Do the commands from start on match pattern?"""
+        if start + len(pattern) > len(commands):
+            return False
+        for expected, command in zip(pattern, commands[start:]):
+            if len(expected) != len(command):
+                return False
+            for expected_word, word in zip(expected, command):
+                if expected_word is not None and expected_word != word:
+                    return False
+        return True
+
+    def optimize_commands(self, commands: list[Command]) -> list[Command]:
+        """
+        Args:
+            commands (list[Command]): VM commands, as split by the Parser.
+
+        Returns:
+            list[Command]: the commands, with every match of a rule replaced.
+        """
+        optimized = []
+        i = 0
+        while i < len(commands):
+            for name, (pattern, rewrite) in self.rules.items():
+                if self.matches(pattern, commands, i):
+                    rewritten = rewrite(*commands[i:i + len(pattern)])
+                    if rewritten is None:  # the rewrite rejected the match
+                        continue
+                    optimized.extend(rewritten)
+                    self.hits[name] += 1
+                    i += len(pattern)
+                    break
+            else:
+                optimized.append(commands[i])
+                i += 1
+        return optimized
+
+    def optimize(self, parser: Parser) -> None:
+        """Rewrites the commands of a parser that did not advance yet.
+
+        Args:
+            parser (Parser): the parser of a file.
+        """
+        parser.commands = self.optimize_commands(parser.commands[:-1]) + \
+            [parser.commands[-1]]  # keeps the end marker
+        parser.current_command = parser.commands[parser.counter]
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: the number of hits of every rule, one rule per line.
+        """
+        return "".join(f"{name}: {hits}\n" for name, hits in self.hits.items())
@@ -0,0 +1,142 @@
+"""
+Turns the profile counters of a program, translated with --profile, into a
+ranked profile of its functions.
+
+Every function of the program gets the counters of index i, in the order the
+functions are defined in the files (sorted by name, as Main translates them):
+RAM[PROFILE_BASE + 4i] and RAM[PROFILE_BASE + 4i + 1] count the calls to the
+function, and RAM[PROFILE_BASE + 4i + 2] and RAM[PROFILE_BASE + 4i + 3] count
+the instructions it ran, with --profile-instructions. Each pair holds the
+count modulo 2^15 and the count divided by 2^15 (see CodeWriter.count_code).
+
+PROFILE_BASE is 256, the bottom of the stack segment, and the bootstrap code
+of a profiled program starts the stack after the counters of its functions,
+so a program with n functions has 4n words less of stack.
+
+The counters are read from a RAM dump, a text file whose lines are either
+"address value" pairs, or bare values of consecutive addresses starting at 0.
+
+Overhead: with --profile, every function has 10 more ROM words, and every
+call runs 4 more instructions (10 when the count wraps). With
+--profile-instructions, every straight-line segment of code of a function
+(after a label, a branch or a call) also has 12 more ROM words, and runs 6
+more instructions (12 when the count wraps) every time control enters it.
+The instructions of the counters are not counted themselves. Without these
+options the translation does not change at all.
+
+Instruction counts are estimates: a comparison or a division is counted as a
+whole, although only one of its branches runs, so counts are a few percent
+higher than the instructions actually run.
+
+Usage: python Profiler.py <path> <ram dump> [--top N]
+"""
+import argparse
+import os
+import sys
+import typing
+from CallGraph import call_graph
+from CodeWriter import PROFILE_BASE, PROFILE_WORDS
+
+
+def profile_slots(input_paths: list[str]) -> dict[str, int]:
+    """
+    Args:
+        input_paths (list[str]): the .vm files of a program, in the order
+            they are translated.
+
+    Returns:
+        dict[str, int]: the index of the counters of every function.
+    """
+    return {name: index
+            for index, name in enumerate(call_graph(input_paths))}
+
+
+def read_ram_dump(dump_file: typing.TextIO) -> dict[int, int]:
+    """
+    Args:
+        dump_file (typing.TextIO): a RAM dump.
+
+    Returns:
+        dict[int, int]: the value of every address in the dump.
+    """
+    ram = {}
+    address = 0
+    for line in dump_file:
+        words = line.replace(":", " ").split()
+        if not words:
+            continue
+        if len(words) == 1:
+            ram[address] = int(words[0])
+        elif len(words) == 2:
+            address = int(words[0])
+            ram[address] = int(words[1])
+        else:
+            raise ValueError(f"invalid line in RAM dump: {line.strip()}")
+        address += 1
+    return ram
+
+
+def read_profile(slots: dict[str, int],
+                 ram: dict[int, int]) -> dict[str, tuple[int, int]]:
+    """
+    Args:
+        slots (dict[str, int]): the index of the counters of every function.
+        ram (dict[int, int]): the RAM of the profiled program.
+
+    Returns:
+        dict[str, tuple[int, int]]: the calls and the instructions of every
+        function.
+    """
+    def count(address: int) -> int:
+        return (ram.get(address, 0) & 0x7FFF) + 32768 * ram.get(address + 1, 0)
+
+    return {name: (count(PROFILE_BASE + PROFILE_WORDS * index),
+                   count(PROFILE_BASE + PROFILE_WORDS * index + 2))
+            for name, index in slots.items()}
+
+
+def report(profile: dict[str, tuple[int, int]],
+           top: typing.Optional[int] = None) -> str:
+    """
+    Args:
+        profile (dict[str, tuple[int, int]]): the calls and the instructions
+            of every function.
+        top (int): if given, only the first top functions are reported.
+
+    Returns:
+        str: the called functions, ranked by instructions and then by calls.
+    """
+    ranked = sorted(((instructions, calls, name)
+                     for name, (calls, instructions) in profile.items()
+                     if calls or instructions), reverse=True)[:top]
+    total = sum(instructions for _, instructions in profile.values()) or 1
+    lines = [f"{'instructions':>12} {'%':>6} {'calls':>10}  function\n"]
+    for instructions, calls, name in ranked:
+        lines.append(f"{instructions:>12} {instructions / total:>6.1%} "
+                     f"{calls:>10}  {name}\n")
+    return "".join(lines)
+
+
+if "__main__" == __name__:
+    argument_parser = argparse.ArgumentParser(prog="Profiler")
+    argument_parser.add_argument(
+        "path", help="the .vm file or the directory that was translated")
+    argument_parser.add_argument("dump", help="a RAM dump of the program")
+    argument_parser.add_argument(
+        "--top", type=int, metavar="N", help="report only N functions")
+    arguments = argument_parser.parse_args()
+    argument_path = os.path.abspath(arguments.path)
+    if os.path.isdir(argument_path):
+        input_paths = [os.path.join(argument_path, filename)
+                       for filename in sorted(os.listdir(argument_path))
+                       if os.path.splitext(filename)[1].lower() == ".vm"]
+    else:
+        input_paths = [argument_path]
+
+    with open(arguments.dump, 'r') as dump_file:
+        try:
+            ram = read_ram_dump(dump_file)
+        except ValueError as error:
+            sys.exit(f"Cannot read {arguments.dump}: {error}")
+    sys.stdout.write(report(read_profile(profile_slots(input_paths), ram),
+                            arguments.top))
@@ -0,0 +1,131 @@
+"""
+An on-disk cache of the assembly fragments of translated .vm files.
+
+A fragment does not depend on the other files of the program, since its
+labels are scoped by the file (see CodeWriter.set_file_name), except through
+the whole-program passes. So a fragment is stored under a key made of:
+
+- the name and the content of the file,
+- the translation options, and the counter slots of --profile,
+- the peephole rules, the functions kept by --eliminate-dead, and the
+  functions that can be inlined with their bodies,
+- the source code of the translator itself.
+
+Every entry also keeps the peephole hits and the inlined call sites of its
+file, so the reports of a build are the same whether or not it was cached.
+"""
+import glob
+import hashlib
+import json
+import os
+import typing
+from Inliner import Inliner
+from Peephole import Peephole
+
+TRANSLATOR_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def translator_digest() -> str:
+    """
+    Returns:
+        str: a digest of the source code of the translator, so fragments are
+        translated again when the translator changes.
+    """
+    digest = hashlib.sha256()
+    for source_path in sorted(glob.glob(os.path.join(TRANSLATOR_DIRECTORY,
+                                                     "*.py"))):
+        with open(source_path, 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """Stores and loads the translation of every file by its key, and counts
+    the files that were reused and translated."""
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+            directory (str): the directory of the cache, created if needed.
+        """
+        self.directory = directory
+        self.translator = translator_digest()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_path: str, peephole: typing.Optional[Peephole],
+            functions: typing.Optional[typing.Container[str]],
+            inliner: typing.Optional[Inliner], options: dict) -> str:
+        """
+        Args:
+            input_path (str): the .vm file.
+            peephole (Peephole): the peephole optimizer of the translation.
+            functions (typing.Container[str]): the translated functions.
+            inliner (Inliner): the inliner of the translation.
+            options (dict): translation options, see CodeWriter.
+
+        Returns:
+            str: the key of the translation of the file.
+        """
+        with open(input_path, 'rb') as input_file:
+            content = hashlib.sha256(input_file.read()).hexdigest()
+        settings = {
+            "file": os.path.basename(input_path),
+            "content": content,
+            "options": sorted(
+                (name, sorted(value.items()) if isinstance(value, dict)
+                 else value) for name, value in options.items()),
+            "peephole": None if peephole is None else list(peephole.rules),
+            "functions": None if functions is None else sorted(functions),
+            "inline": None if inliner is None else sorted(
+                inliner.functions.items()),
+            "translator": self.translator,
+        }
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        Args:
+            key (str): the key of a translation.
+
+        Returns:
+            str: the path of the cache entry of the translation.
+        """
+        return os.path.join(self.directory, key + ".json")
+
+    def load(self, key: str) -> typing.Optional[tuple]:
+        """
+        Args:
+            key (str): the key of a translation.
+
+        Returns:
+            tuple: the assembly code of the file, the hits of every peephole
+            rule, and the inlined call sites and the cycles saved by every
+            inlined function (see Main.translate_in_worker), or None if the
+            translation is not cached.
+        """
+        try:
+            with open(self.path(key), 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):  # missing or damaged entries
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (entry["fragment"], entry["hits"],
+                entry["inlined"] and tuple(entry["inlined"]))
+
+    def store(self, key: str, result: tuple) -> None:
+        """Stores a translation, replacing the entry atomically so concurrent
+        builds never read a partial entry.
+
+        Args:
+            key (str): the key of the translation.
+            result (tuple): the translation, see load.
+        """
+        fragment, hits, inlined = result
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = self.path(key) + "." + str(os.getpid())
+        with open(temporary_path, 'w') as entry_file:
+            json.dump({"fragment": fragment, "hits": hits,
+                       "inlined": inlined}, entry_file)
+        os.replace(temporary_path, self.path(key))
@@ -0,0 +1,494 @@
+"""
+Checks that an optimized translation of straight-line VM code is equivalent
+to the plain translation.
+
+Every basic block of the input is translated twice: once plainly, and once
+with the given CodeWriter options, after the peephole optimizer if one is
+given, so the fused commands of the optimized translation are checked
+against the commands they replace. A block is a run of push, pop, arithmetic
+and comparison commands and calls to Math.multiply and Math.divide, together
+with the command that ends it if there is one: an if-goto, a goto, a return,
+or a call followed by a return (a tail call).
+
+Both translations are run by a small interpreter of Hack assembly from the
+same random machine state. The calls to Math.multiply and Math.divide are
+not translated, but computed by the interpreter as the OS of this repository
+computes them (see os_divide). The shared routines of the options are
+translated with the block, and the function that a block calls is replaced
+by a stub that keeps its arguments in static variables. A block that returns
+runs in a frame of its function, whose return address is beyond the code.
+A call with a constant argument, which the peephole optimizer may replace by
+shifts, is also run on its own with every value of OPERANDS as the other
+argument, since random values rarely hit the cases that divisions handle
+separately.
+
+The translations are equivalent if they leave the same memory, except for
+the scratch registers R13-R15 and the unused part of the stack above SP,
+which the plain translation uses as scratch space, and the temp segment in
+blocks that call a function, which is not preserved across calls, and if
+they leave the block the same way: through the same jump, or at its end.
+"""
+import copy
+import io
+import os
+import random
+import typing
+from CodeWriter import CodeWriter, ART_DICT, CACHED_UNARY_DICT
+from Parser import Parser, compile_command
+from Peephole import Peephole
+
+STRAIGHT_LINE_COMMANDS = {"push", "pop", *ART_DICT}
+BRANCH_COMMANDS = {"goto", "if-goto", "return"}  # may end a block
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+                      **{"R" + str(i): i for i in range(16)}}
+SCRATCH_SIZE = 64  # words above SP that may hold garbage after a block
+TRIALS = 4  # random machine states per block
+RETURN_ADDRESS = 32767  # beyond the code of every block
+TEMP_SEGMENT = range(5, 13)
+# the values that the fused multiplications and divisions are also checked
+# with: the bounds of the 16-bit range, and the powers of two and their
+# neighbours, which the divisions by powers of two handle separately
+OPERANDS = sorted({value & 0xFFFF for power in range(16) for value in (
+    1 << power, (1 << power) - 1, -1 << power, 1 - (1 << power))})
+
+
+class RandomMemory(dict):
+    """Memory whose words hold random values until they are written."""
+
+    def __init__(self, seed: int) -> None:
+        super().__init__()
+        self.seed = seed
+
+    def __missing__(self, address: int) -> int:
+        return random.Random(self.seed * 65536 + address).randrange(65536)
+
+
+def signed(value: int) -> int:
+    """
+    Args:
+        value (int): an integer.
+
+    Returns:
+        int: the 16-bit two's complement value of its lowest 16 bits.
+    """
+    value &= 0xFFFF
+    return value - 65536 if value & 0x8000 else value
+
+
+def divide_helper(x: int, y: int) -> int:
+    """Math.divide_helper of the OS, in 16-bit arithmetic."""
+    if y > x:
+        return 0
+    current_y, total = y, 0
+    while not y > x:
+        current_sum = 1
+        while not current_y > x and current_y >= 0:
+            if current_y == x:
+                return signed(total + current_sum)
+            current_sum, current_y = (signed(current_sum << 1),
+                                      signed(current_y << 1))
+        x, total, current_y = (signed(x - (current_y >> 1)),
+                               signed(total + (current_sum >> 1)), y)
+    return total
+
+
+def os_divide(x: int, y: int) -> int:
+    """Computes Math.divide of the OS, which halves dividends that are
+    larger than 16383, so their quotients may be a little off.
+
+    Args:
+        x (int): the 16-bit dividend.
+        y (int): the 16-bit divisor.
+
+    Returns:
+        int: the 16-bit quotient, or 0 if y is 0 or -32768, for which the
+        OS does not return.
+    """
+    x, y = signed(x), signed(y)
+    absolute_x, absolute_y = signed(abs(x)), signed(abs(y))
+    if absolute_y <= 0:
+        return 0
+    if absolute_x > 16383:
+        quotient = signed(divide_helper(absolute_x >> 1, absolute_y) << 1)
+    else:
+        quotient = divide_helper(absolute_x, absolute_y)
+    return (quotient if (x < 0) == (y < 0) else -quotient) & 0xFFFF
+
+
+MODELLED_CALLS = {("call", "Math.multiply", "2"): lambda x, y: x * y & 0xFFFF,
+                  ("call", "Math.divide", "2"): os_divide}
+
+
+def evaluate(comp: str, a: int, d: int, m: int) -> int:
+    """Computes the comp part of a C-instruction.
+
+    Args:
+        comp (str): the computation, e.g. "D+M", "!A" or "M<<".
+        a (int): the A register.
+        d (int): the D register.
+        m (int): the memory word at A.
+
+    Returns:
+        int: the 16-bit result.
+    """
+    values = {"A": a, "D": d, "M": m, "0": 0, "1": 1}
+    if comp.endswith("<<"):
+        return (values[comp[0]] << 1) & 0xFFFF
+    if comp.endswith(">>"):  # arithmetic shift
+        value = values[comp[0]]
+        return (value >> 1) | (value & 0x8000)
+    if comp[0] == "!":
+        return ~values[comp[1]] & 0xFFFF
+    if comp[0] == "-":
+        return -values[comp[1]] & 0xFFFF
+    if len(comp) == 1:
+        return values[comp]
+    x, operator, y = values[comp[0]], comp[1], values[comp[2]]
+    if operator == "+":
+        return (x + y) & 0xFFFF
+    if operator == "-":
+        return (x - y) & 0xFFFF
+    return x & y if operator == "&" else x | y
+
+
+def jump_taken(jump: str, value: int) -> bool:
+    """
+    Args:
+        jump (str): the jump part of a C-instruction, e.g. "JNE".
+        value (int): the 16-bit result of the computation.
+
+    Returns:
+        bool: does the instruction jump?
+    """
+    value = signed(value)
+    return {"JGT": value > 0, "JEQ": value == 0, "JGE": value >= 0,
+            "JLT": value < 0, "JNE": value != 0, "JLE": value <= 0,
+            "JMP": True}[jump]
+
+
+def run_block(assembly: str, memory: dict[int, int],
+              variables: dict[str, int]) -> typing.Optional[str]:
+    """Runs the assembly code of a block on memory. Jumps to labels of the
+    block are followed, and a jump to any other label, or to an address
+    beyond the code, leaves the block. A line that is a modelled call (see
+    MODELLED_CALLS) replaces its two arguments on the stack by the result.
+
+    Args:
+        assembly (str): the code.
+        memory (dict[int, int]): the memory, changed in place.
+        variables (dict[str, int]): the addresses of variables, new variables
+            are added with addresses from 16 upwards.
+
+    Returns:
+        str: the label or the address the block jumped to, or None if it ran
+        to its end.
+    """
+    instructions = []
+    labels = {}  # label -> index of the instruction it marks
+    for line in assembly.splitlines():
+        line = line.strip()
+        if line and line[0] == "(":
+            labels[line[1:-1]] = len(instructions)
+        elif line:
+            instructions.append(line)
+    exits = {}  # fake ROM addresses of labels outside the block
+    a = d = 0
+    counter = 0
+    while counter < len(instructions):
+        line = instructions[counter]
+        counter += 1
+        if line[0] == "@":
+            value = line[1:]
+            if value in PREDEFINED_SYMBOLS:
+                value = PREDEFINED_SYMBOLS[value]
+            elif value in labels:
+                value = labels[value]
+            elif "$" in value:  # generated labels are scoped by functions
+                value = exits.setdefault(value, 65536 + len(exits))
+            elif not value.isdigit():
+                value = variables.setdefault(value, 16 + len(variables))
+            a = int(value)
+            continue
+        if line.startswith("call "):
+            memory[0] -= 1
+            memory[memory[0] - 1] = MODELLED_CALLS[tuple(line.split())](
+                memory[memory[0] - 1], memory[memory[0]])
+            continue
+        instruction, _, jump = line.partition(";")
+        dest, _, comp = instruction.rpartition("=")
+        result = evaluate(comp, a, d, memory[a])
+        target = a
+        if "M" in dest:
+            memory[a] = result
+        if "D" in dest:
+            d = result
+        if "A" in dest:
+            a = result
+        if jump and jump_taken(jump, result):
+            if target >= 65536:
+                return next(label for label, address in exits.items()
+                            if address == target)
+            if target > len(instructions):
+                return "address " + str(target)
+            counter = target
+    return None
+
+
+def is_straight_line(command: list[str]) -> bool:
+    """
+    Args:
+        command (list[str]): the words of a command.
+
+    Returns:
+        bool: does the command run straight through to the next one?
+    """
+    return command[0] in STRAIGHT_LINE_COMMANDS or \
+        tuple(command) in MODELLED_CALLS
+
+
+def basic_blocks(parser: Parser) -> typing.Iterator[list[list[str]]]:
+    """
+    Args:
+        parser (Parser): the parser of a file.
+
+    Returns:
+        typing.Iterator[list[list[str]]]: the maximal runs of straight-line
+        commands in the file, each with the branch, the return, or the call
+        and the return that ends it, if any.
+    """
+    commands = parser.commands[:-1]
+    block = []
+    for index, command in enumerate(commands):
+        if is_straight_line(command) or (
+                command[0] == "call" and commands[index + 1:index + 2] ==
+                [["return"]]):
+            block.append(command)
+            continue
+        if command[0] in BRANCH_COMMANDS:
+            block.append(command)
+        if block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def called_function(block: list[list[str]]) -> typing.Optional[list[str]]:
+    """
+    Args:
+        block (list[list[str]]): the commands of a block.
+
+    Returns:
+        list[str]: the name and the number of arguments of the function
+        that the block calls, other than the modelled calls, if any.
+    """
+    for command in block:
+        if command[0] in ("call", "tail-call") and \
+                ("call", *command[1:]) not in MODELLED_CALLS:
+            return command[1:]
+    return None
+
+
+def constant_calls(block: list[list[str]]) -> set[tuple[tuple[str, ...], ...]]:
+    """
+    Args:
+        block (list[list[str]]): the commands of a block.
+
+    Returns:
+        set[tuple[tuple[str, ...], ...]]: the calls to the modelled functions
+        (see MODELLED_CALLS) in the block that have a constant argument, each
+        as the block of the push of the constant and the call.
+    """
+    calls = set()
+    for index, command in enumerate(block):
+        if tuple(command) not in MODELLED_CALLS:
+            continue
+        if block[index - 1][:2] == ["push", "constant"]:
+            calls.add((tuple(block[index - 1]), tuple(command)))
+        elif index > 1 and block[index - 2][:2] == ["push", "constant"] and \
+                block[index - 1][0] == "push":
+            calls.add((tuple(block[index - 2]), tuple(command)))
+    return calls
+
+
+def stub(function_name: str, n_args: int) -> list[list[str]]:
+    """
+    Args:
+        function_name (str): the name of a function.
+        n_args (int): the number of its arguments.
+
+    Returns:
+        list[list[str]]: a function of the name that keeps its arguments in
+        static variables, changes THIS and THAT, and returns its first
+        argument.
+    """
+    commands = [["function", function_name, "0"]]
+    for index in range(n_args):
+        commands += [["push", "argument", str(index)],
+                     ["pop", "static", str(index)]]
+    for index in range(2):
+        commands += [["push", "constant", str(index + 1)],
+                     ["pop", "pointer", str(index)]]
+    return commands + [["push", "argument" if n_args else "constant", "0"],
+                       ["return"]]
+
+
+def translate_block(block: list[list[str]], file_name: str,
+                    peephole: typing.Optional[Peephole] = None,
+                    **options: bool) -> str:
+    """Translates a basic block, leaving the stack in memory at its end. The
+    block is preceded by the shared routines and the stub of the function
+    it calls (see stub), which are jumped over."""
+    if peephole is not None:
+        block = peephole.optimize_commands(block)
+    output = io.StringIO()
+    code_writer = CodeWriter(output, **options)
+    code_writer.write("@$block\n0;JMP\n")
+    code_writer.write_shared_routines()
+    function = called_function(block)
+    if function is not None:
+        code_writer.set_file_name("Stub.vm")
+        code_writer.write_commands(
+            map(compile_command, stub(function[0], int(function[1]))))
+    code_writer.write("($block)\n")
+    code_writer.set_file_name(file_name)
+    for command in block:
+        if tuple(command) in MODELLED_CALLS:
+            code_writer.flush()
+            code_writer.write(" ".join(command) + "\n")
+        else:
+            code_writer.write_commands([compile_command(command)])
+    code_writer.close()
+    return output.getvalue()
+
+
+def block_frame(block: list[list[str]]) -> tuple[int, int, int]:
+    """
+    Args:
+        block (list[list[str]]): the commands of a block.
+
+    Returns:
+        tuple[int, int, int]: the number of arguments and local variables
+        that the block uses, and the number of values it pops below the
+        stack it starts with.
+    """
+    sizes = {"argument": 0, "local": 0}
+    depth = lowest = 0
+    for command in block:
+        if command[0] in ("push", "pop") and command[1] in sizes:
+            sizes[command[1]] = max(sizes[command[1]], int(command[2]) + 1)
+        if command[0] == "push":
+            depth += 1
+        elif command[0] == "call":
+            depth += 1 - int(command[2])
+        elif command[0] not in CACHED_UNARY_DICT and command[0] != "goto":
+            depth -= 1  # pop, binary commands, if-goto and return
+        lowest = min(lowest, depth)
+    return sizes["argument"], sizes["local"], -lowest
+
+
+def random_state(seed: int, frame: typing.Optional[tuple[int, int, int]] = None
+                 ) -> RandomMemory:
+    """
+    Args:
+        seed (int): the seed of the random values.
+        frame (tuple[int, int, int]): if given, the stack holds a frame of a
+            function (see block_frame), whose caller is returned to at
+            RETURN_ADDRESS.
+
+    Returns:
+        RandomMemory: a random memory, with the stack and the segments in
+        separate areas.
+    """
+    memory = RandomMemory(seed)
+    generator = random.Random(seed)
+    memory[0] = generator.randrange(300, 2000)  # SP
+    for register in range(1, 5):  # LCL, ARG, THIS, THAT
+        memory[register] = generator.randrange(2048 * register,
+                                               2048 * (register + 1))
+    if frame is not None:
+        n_args, n_locals, depth = frame
+        memory[2] = generator.randrange(300, 1000)  # ARG
+        memory[1] = memory[2] + n_args + 5  # LCL, after the saved frame
+        memory[memory[1] - 5] = RETURN_ADDRESS
+        memory[0] = memory[1] + n_locals + depth + generator.randrange(8)
+    return memory
+
+
+def operand_state(operand: int) -> RandomMemory:
+    """
+    Args:
+        operand (int): a 16-bit value.
+
+    Returns:
+        RandomMemory: a random memory (see random_state), with the operand
+        pushed on the stack.
+    """
+    memory = random_state(operand)
+    memory[memory[0]] = operand
+    memory[0] += 1
+    return memory
+
+
+def equivalent(plain: str, optimized: str, states: list[RandomMemory],
+               ignored: typing.Container[int] = ()) -> bool:
+    """
+    Args:
+        plain (str): the plain translation of a block.
+        optimized (str): the optimized translation of the block.
+        states (list[RandomMemory]): the machine states to run both from.
+        ignored (typing.Container[int]): addresses that may be left
+            different, besides the scratch registers and the stack above SP.
+
+    Returns:
+        bool: do both translations leave every state the same way?
+    """
+    variables = {}
+    for state in states:
+        expected, actual = copy.copy(state), copy.copy(state)
+        expected_exit = run_block(plain, expected, variables)
+        actual_exit = run_block(optimized, actual, variables)
+        scratch = range(expected[0], max(state[0], expected[0]) + SCRATCH_SIZE)
+        if expected_exit != actual_exit or any(
+                expected[address] != actual[address]
+                for address in expected.keys() | actual.keys()
+                if not 13 <= address <= 15 and address not in scratch and
+                address not in ignored):
+            return False
+    return True
+
+
+def verify_file(input_file: typing.TextIO,
+                peephole: typing.Optional[Peephole] = None,
+                **options: bool) -> tuple[int, list[str]]:
+    """Verifies the translation of the blocks of a file with options.
+
+    Args:
+        input_file (typing.TextIO): the file.
+        peephole (Peephole): if given, the rules to verify with the options.
+        **options (bool): the CodeWriter options to verify.
+
+    Returns:
+        tuple[int, list[str]]: the number of blocks checked, and a
+        description of every block that was translated differently.
+    """
+    parser = Parser(input_file)
+    file_name = os.path.basename(getattr(input_file, "name", "Input.vm"))
+    checked = 0
+    failures = []
+    for block in basic_blocks(parser):
+        frame = block_frame(block) if block[-1][0] == "return" else None
+        checks = [(block, [random_state(seed, frame) for seed in range(TRIALS)])]
+        checks += [(list(map(list, calls)),
+                    list(map(operand_state, OPERANDS)))
+                   for calls in constant_calls(block)]
+        ignored = TEMP_SEGMENT if called_function(block) is not None else ()
+        if not all(equivalent(translate_block(commands, file_name),
+                              translate_block(commands, file_name, peephole,
+                                              **options),
+                              states, ignored)
+                   for commands, states in checks):
+            failures.append(f"{file_name}: "
+                            f"{'; '.join(' '.join(c) for c in block)}")
+        checked += 1
+    return checked, failures